@@ -0,0 +1,103 @@
+"""Run research queries in bulk, outside Streamlit.
+
+Usage:
+    python batch_runner.py queries.jsonl --out batch_results --workers 4
+
+Each input line is a JSON object with a "query" and optionally an "id" and
+any ResearchOptions field (for example "max_steps"). Reports are written to
+<out>/<id>.md and one timing record per query is appended to
+<out>/timings.jsonl.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import fields
+
+from engine import ResearchOptions, run_research
+
+OPTION_FIELDS = {f.name for f in fields(ResearchOptions)}
+
+
+def load_queries(path):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault("id", f"query-{line_no}")
+            records.append(record)
+    return records
+
+
+def run_one(record, out_dir):
+    """Run one query and write its report; returns the timing record."""
+    # Batch queries queue behind interactive sessions for rate-limited capacity.
+    options = ResearchOptions(**{"priority": "batch", **{k: v for k, v in record.items() if k in OPTION_FIELDS}})
+    started = time.perf_counter()
+    timing = {"id": record["id"], "query": record["query"]}
+    try:
+        state = run_research(record["query"], options)
+        report_path = os.path.join(out_dir, f"{record['id']}.md")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(state.report or "")
+        timing.update(
+            status="ok",
+            steps=len(state.steps),
+            report=report_path,
+            replan_stats=state.replan_stats,
+            dedup_stats=state.dedup_stats,
+            **state.timings,
+        )
+    except Exception as e:
+        logging.error(f"Research failed for {record['id']}: {e}")
+        timing.update(status="error", error=str(e))
+    timing["wall_seconds"] = time.perf_counter() - started
+    return timing
+
+
+def run_batch(records, out_dir, workers=4, use_processes=False):
+    """Run all records on a worker pool, appending timings as queries finish."""
+    os.makedirs(out_dir, exist_ok=True)
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    timings = []
+    with executor_class(max_workers=workers) as pool, open(
+        os.path.join(out_dir, "timings.jsonl"), "a", encoding="utf-8"
+    ) as timings_file:
+        futures = [pool.submit(run_one, record, out_dir) for record in records]
+        for future in as_completed(futures):
+            timing = future.result()
+            timings.append(timing)
+            timings_file.write(json.dumps(timing) + "\n")
+            timings_file.flush()
+            logging.info(
+                f"[{len(timings)}/{len(records)}] {timing['id']}: {timing['status']} "
+                f"in {timing['wall_seconds']:.1f}s"
+            )
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run deepQuest research queries from a JSONL file.")
+    parser.add_argument("queries", help="JSONL file with one {\"query\": ...} object per line")
+    parser.add_argument("--out", default="batch_results", help="output directory")
+    parser.add_argument("--workers", type=int, default=4, help="queries run at the same time")
+    parser.add_argument("--processes", action="store_true", help="use worker processes instead of threads")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    records = load_queries(args.queries)
+    started = time.perf_counter()
+    timings = run_batch(records, args.out, workers=args.workers, use_processes=args.processes)
+    failed = sum(1 for t in timings if t["status"] != "ok")
+    logging.info(
+        f"Finished {len(timings)} queries ({failed} failed) in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
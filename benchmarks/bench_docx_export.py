@@ -0,0 +1,76 @@
+"""Benchmark the Markdown-to-DOCX exporter on a synthetic 100-page report.
+
+Usage:
+    python -m benchmarks.bench_docx_export --pages 100 --repeat 3
+"""
+
+import argparse
+import statistics
+import time
+
+import docx_export
+from docx_export import markdown_to_docx
+
+# Roughly what fits on one page of the exported document.
+WORDS_PER_PAGE = 500
+TARGET_SECONDS = 1.0
+
+SENTENCE = (
+    "Grid-scale **battery storage** capacity grew *sharply* in 2024, led by "
+    "lithium iron phosphate projects reported by [IEA](https://www.iea.org/reports/batteries) "
+    "and `EIA-860M` filings. "
+)
+
+
+def make_report(pages):
+    """Markdown with headings, inline formatting, nested lists and one table per ten pages."""
+    sentence_words = len(SENTENCE.split())
+    parts = ["# Synthetic Research Report\n"]
+    for page in range(pages):
+        parts.append(f"## Section {page + 1}\n")
+        words = 0
+        while words < WORDS_PER_PAGE - 120:
+            parts.append(SENTENCE * 5 + "\n")
+            words += 5 * sentence_words
+        parts.append(
+            "- Key finding with **emphasis**\n"
+            "  - Supporting detail from [source](https://example.com/a)\n"
+            "    - Nested note with `code`\n"
+            "- Second finding\n\n"
+            "1. Ranked item one\n"
+            "2. Ranked item two\n\n"
+            "> A quoted analyst remark with *italics*.\n"
+        )
+        if page % 10 == 9:
+            rows = ["| Region | Year | Capacity (GWh) | Source |", "|---|---|---|---|"]
+            rows += [f"| Region {i} | {2015 + i % 10} | {i * 3.5:.1f} | [ref](https://example.com/{i}) |" for i in range(60)]
+            parts.append("\n".join(rows) + "\n")
+    return "\n".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markdown_to_docx.")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    report = make_report(args.pages)
+    cold = []
+    for _ in range(args.repeat):
+        docx_export._docx_cache = docx_export.LRUCache(max_entries=docx_export.DOCX_CACHE_SIZE)
+        started = time.perf_counter()
+        data = markdown_to_docx(report)
+        cold.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    markdown_to_docx(report)
+    cached = time.perf_counter() - started
+
+    median = statistics.median(cold)
+    print(f"{args.pages} pages, {len(report.split())} words, {len(report) / 1024:.0f} KB markdown -> {len(data) / 1024:.0f} KB docx")
+    print(f"cold export: median {median:.3f}s, best {min(cold):.3f}s over {args.repeat} runs")
+    print(f"cached export: {cached * 1000:.2f} ms")
+    print(f"{'PASS' if median < TARGET_SECONDS else 'FAIL'}: target is under {TARGET_SECONDS:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
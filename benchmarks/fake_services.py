@@ -0,0 +1,302 @@
+"""Local stand-ins for Azure OpenAI and the search providers.
+
+One threaded HTTP server answers:
+- Azure chat completions (plain, tool-calling and streamed) with configurable
+  latency and output size
+- Google Custom Search, ArXiv, NewsAPI, SEC, Wikipedia with canned payloads
+- HTML pages linked from the Google results, for the crawler
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = (
+    "energy storage grid policy market growth capacity solar wind battery cost "
+    "analysis report data trend forecast region investment technology supply"
+).split()
+
+
+def lorem(n_words, seed=""):
+    offset = int(hashlib.md5(seed.encode("utf-8")).hexdigest()[:6], 16)
+    return " ".join(WORDS[(offset + i * 7) % len(WORDS)] for i in range(n_words))
+
+
+class FakeServiceConfig:
+    """Knobs for one benchmark scenario."""
+
+    def __init__(
+        self,
+        plan_steps=5,
+        llm_latency=0.2,
+        seconds_per_token=0.0005,
+        completion_tokens=300,
+        tool_calls_per_turn=1,
+        provider_latency=0.05,
+        page_kb=20,
+        failing_paths=(),
+    ):
+        self.plan_steps = plan_steps
+        self.llm_latency = llm_latency
+        self.seconds_per_token = seconds_per_token
+        self.completion_tokens = completion_tokens
+        self.tool_calls_per_turn = tool_calls_per_turn
+        self.provider_latency = provider_latency
+        self.page_kb = page_kb
+        # Endpoints (e.g. "/arxiv") that answer 503, to exercise retries and breakers.
+        self.failing_paths = tuple(failing_paths)
+
+
+class FakeServices:
+    """Runs the fake endpoints on a background thread; use as a context manager."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeServiceConfig()
+        services = self
+
+        class Handler(FakeHandler):
+            pass
+
+        Handler.services = services
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    services = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type="application/json", status=200):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        try:
+            self.wfile.write(data)
+        except ConnectionError:
+            # Clients that stop reading early (byte caps, head-only parsing) hang up.
+            self.close_connection = True
+
+    # --- Providers ---
+
+    def do_GET(self):
+        config = self.services.config
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        time.sleep(config.provider_latency)
+        if url.path in config.failing_paths:
+            self.services.count(f"failed {url.path}")
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if url.path == "/customsearch/v1":
+            self.services.count("google")
+            query = params.get("q", "")
+            slug = hashlib.md5(query.encode("utf-8")).hexdigest()[:10]
+            items = [
+                {
+                    "title": f"Result {i + 1} for {query}",
+                    "displayLink": "bench.local",
+                    "snippet": lorem(30, f"{query}{i}"),
+                    "link": f"{self.services.base_url}/pages/{slug}-{i}.html",
+                }
+                for i in range(5)
+            ]
+            self._send(json.dumps({"items": items}))
+        elif url.path == "/arxiv":
+            self.services.count("arxiv")
+            entries = "".join(
+                f"<entry><id>{self.services.base_url}/abs/{i}</id><title>Paper {i}</title>"
+                f"<summary>{lorem(80, str(i))}</summary></entry>"
+                for i in range(3)
+            )
+            self._send(f'<feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>', "application/atom+xml")
+        elif url.path == "/newsapi/v2/everything":
+            self.services.count("news")
+            articles = [
+                {
+                    "title": f"News {i}",
+                    "source": {"name": "Bench Wire"},
+                    "description": lorem(40, f"news{i}"),
+                    "url": f"{self.services.base_url}/news/{i}",
+                }
+                for i in range(5)
+            ]
+            self._send(json.dumps({"status": "ok", "articles": articles}))
+        elif url.path == "/sec":
+            self.services.count("sec")
+            entries = "".join(
+                f'<entry><title>10-K Annual report {i}</title><updated>2025-0{i + 1}-15</updated>'
+                f'<link href="{self.services.base_url}/filings/{i}"/></entry>'
+                for i in range(2)
+            )
+            self._send(f'<feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>', "application/atom+xml")
+        elif url.path == "/wikipedia":
+            self.services.count("wikipedia")
+            page = {"title": "Bench", "fullurl": f"{self.services.base_url}/wiki/Bench", "extract": lorem(120, "wiki")}
+            self._send(json.dumps({"query": {"pages": {"1": {"index": 1, **page}}}}))
+        elif url.path.startswith("/pages/"):
+            self.services.count("page heads" if self.command == "HEAD" else "pages")
+            paragraphs = "".join(
+                f"<p>{lorem(100, url.path + str(i))}</p>"
+                for i in range(max(config.page_kb * 1024 // 700, 1))
+            )
+            self._send(
+                f"<html><head><title>{url.path}</title></head><body><nav>Home About</nav>"
+                f"<article>{paragraphs}</article><footer>Copyright</footer></body></html>",
+                "text/html",
+            )
+        else:
+            self._send(json.dumps({"error": "not found"}), status=404)
+
+    def do_HEAD(self):
+        # The crawler checks a page's declared size before rendering it.
+        self.do_GET()
+
+    # --- Azure OpenAI ---
+
+    def do_POST(self):
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self._send(json.dumps({"error": "not found"}), status=404)
+            return
+        config = self.services.config
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        messages = request["messages"]
+        prompt = messages[-1].get("content") or ""
+        prompt_tokens = len(json.dumps(messages)) // 4
+
+        tool_calls = None
+        if "User Query:" in prompt and "research plan" in prompt:
+            self.services.count("llm_plan")
+            query = prompt.split("User Query:", 1)[1].strip()
+            # Two independent fact-gathering steps per comparison step.
+            lines = []
+            for i in range(1, config.plan_steps + 1):
+                depends = f"{i - 2}, {i - 1}" if i % 3 == 0 else "none"
+                lines.append(f"{i}. Research aspect {i} of {query} (depends on: {depends})")
+            text = "\n".join(lines)
+        elif "Current research plan" in prompt:
+            self.services.count("llm_replan")
+            text = "No additional steps needed."
+        elif request.get("tools") and request.get("tool_choice") == "auto" and not any(
+            m.get("role") == "tool" for m in messages
+        ):
+            self.services.count("llm_tool_call")
+            text = None
+            step = prompt.split("Step:", 1)[-1].split("\n", 1)[0].strip()
+            tool_calls = [
+                {
+                    "id": f"call_{i}",
+                    "type": "function",
+                    "function": {
+                        "name": "search_google",
+                        "arguments": json.dumps({"query": f"{step} {i}"}),
+                    },
+                }
+                for i in range(config.tool_calls_per_turn)
+            ]
+        else:
+            self.services.count("llm_answer")
+            # Answers cite the first few sources they were shown, as a real model would.
+            seen = re.findall(r"https?://[^\s)\]>\"'\\]+", json.dumps(messages))
+            cited = list(dict.fromkeys(seen))[:3] or ["https://bench.local/source"]
+            text = lorem(config.completion_tokens, prompt[:200]) + " " + " ".join(cited)
+
+        completion_tokens = len(text.split()) if text else 20
+        time.sleep(config.llm_latency + completion_tokens * config.seconds_per_token)
+
+        if request.get("stream"):
+            usage = None
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+            self._stream(text, request.get("model", "gpt-4.1"), usage)
+            return
+        message = {"role": "assistant", "content": text}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        self._send(
+            json.dumps(
+                {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "gpt-4.1"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": message,
+                            "finish_reason": "tool_calls" if tool_calls else "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                }
+            )
+        )
+
+    def _stream(self, text, model, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = text.split(" ")
+        for start in range(0, len(words), 20):
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": " ".join(words[start : start + 20]) + " "}, "finish_reason": None}
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        if usage is not None:
+            # As with stream_options.include_usage: a last chunk without choices.
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
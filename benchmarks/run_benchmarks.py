@@ -0,0 +1,247 @@
+"""Offline end-to-end benchmarks for the research pipeline.
+
+Runs the full engine (plan, parallel steps with tool calls, provider fan-out,
+crawling, replanning, sectioned report) against the local stand-ins in
+fake_services, so results depend only on the code and the scenario knobs.
+
+Usage:
+    python -m benchmarks.run_benchmarks                     # all scenarios
+    python -m benchmarks.run_benchmarks --scenario 5-step --runs 5
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/old.json
+
+Results are written as JSON to benchmarks/results/ for comparison over time.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from benchmarks.fake_services import FakeServiceConfig, FakeServices
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+SCENARIOS = {
+    "5-step": FakeServiceConfig(plan_steps=5),
+    "20-step": FakeServiceConfig(plan_steps=20),
+    "heavy-crawl": FakeServiceConfig(plan_steps=5, tool_calls_per_turn=3, page_kb=200),
+    "provider-outage": FakeServiceConfig(plan_steps=5, failing_paths=("/arxiv", "/wikipedia")),
+}
+
+
+def configure_environment(base_url, trace_dir):
+    """Point every client at the fake services; must run before the pipeline is imported."""
+    os.environ.update(
+        {
+            "AZURE_OPENAI_ENDPOINT": base_url,
+            "AZURE_OPENAI_API_KEY": "bench",
+            "GOOGLE_API_KEY": "bench",
+            "SEARCH_ENGINE_ID": "bench",
+            "NEWSAPI_KEY": "bench",
+            "GOOGLE_SEARCH_URL": f"{base_url}/customsearch/v1",
+            "ARXIV_API_URL": f"{base_url}/arxiv",
+            "SEC_API_URL": f"{base_url}/sec",
+            "WIKIPEDIA_API_URL": f"{base_url}/wikipedia",
+            "LLM_CACHE_MODE": "off",
+            "CRAWL_CACHE_BACKEND": "memory",
+            "SEARCH_CACHE_BACKEND": "memory",
+            # Citation counts learned from stub data must not bias real provider selection.
+            "SOURCE_STATS_BACKEND": "memory",
+            # Benchmark runs must not show up in JobManager or resume.
+            "CHECKPOINT_ENABLED": "false",
+            # Real quotas would make timings depend on scenario order; the stubs have none.
+            "AZURE_RPM": "0",
+            "AZURE_TPM": "0",
+            "GOOGLE_CSE_QPD": "0",
+            "TRACE_DIR": trace_dir,
+        }
+    )
+
+
+class HttpCrawler:
+    """Plain-HTTP crawler with the AsyncWebCrawler interface, so no browser is needed."""
+
+    async def __aenter__(self):
+        import aiohttp
+
+        self.session = aiohttp.ClientSession()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def arun(self, url, config=None):
+        async with self.session.get(url) as response:
+            html = await response.text()
+        # Block-level tags become paragraph breaks, as in crawler markdown.
+        text = re.sub(r"</?(p|div|nav|article|footer|header|h\d|li)[^>]*>", "\n\n", html)
+        text = re.sub(r"<[^>]+>", "", text)
+        return SimpleNamespace(
+            success=response.status < 400,
+            status_code=response.status,
+            error_message=None if response.status < 400 else response.reason,
+            markdown=re.sub(r"\n{3,}", "\n\n", text),
+            html=html,
+            response_headers=dict(response.headers),
+        )
+
+
+def install_fakes(base_url):
+    """Swap the pieces that cannot be pointed at a URL: NewsAPI's client and the browser."""
+    import requests
+
+    import web_agent
+    from crawler_pool import CrawlerPool, set_crawler_pool
+
+    class FakeNewsApiClient:
+        def __init__(self, api_key=None, session=None):
+            self.api_key = api_key
+
+        def get_everything(self, **params):
+            return requests.get(f"{base_url}/newsapi/v2/everything", params=params, timeout=15).json()
+
+    web_agent.NewsApiClient = FakeNewsApiClient
+    set_crawler_pool(CrawlerPool(crawler_factory=HttpCrawler))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(name, services, runs, concurrency, trace_memory):
+    """Run one scenario ``runs`` times and return its metrics."""
+    from engine import run_research
+    from http_client import http_stats
+    from ratelimit import ratelimit_stats
+    from resilience import resilience_stats
+
+    stage_names = ("plan_seconds", "steps_seconds", "report_seconds", "rate_limit_wait_seconds")
+    records = []
+
+    def one_run(run_idx):
+        started = time.perf_counter()
+        state = run_research(f"{name} benchmark query {run_idx}")
+        with open(state.trace_file, "r", encoding="utf-8") as f:
+            spans = f.read()
+        return {
+            "wall_seconds": time.perf_counter() - started,
+            "steps": len(state.steps),
+            "report_chars": len(state.report or ""),
+            "trace_bytes": len(spans),
+            **{stage: state.timings.get(stage, 0.0) for stage in stage_names},
+        }
+
+    services.counters.clear()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        records = list(pool.map(one_run, range(runs)))
+    total_seconds = time.perf_counter() - started
+    peak_traced_mb = None
+    if trace_memory:
+        peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    walls = [r["wall_seconds"] for r in records]
+    return {
+        "scenario": name,
+        "config": vars(services.config),
+        "runs": runs,
+        "concurrency": concurrency,
+        "wall_seconds_mean": statistics.mean(walls),
+        "wall_seconds_p50": percentile(walls, 0.5),
+        "wall_seconds_max": max(walls),
+        "stage_seconds_mean": {stage: statistics.mean(r[stage] for r in records) for stage in stage_names},
+        "runs_per_minute": 60 * runs / total_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_traced_mb": peak_traced_mb,
+        "service_calls": dict(services.counters),
+        "http_pool": http_stats(),
+        "providers": resilience_stats(),
+        "rate_limits": ratelimit_stats(),
+        "records": records,
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {s["scenario"]: s for s in json.load(f)["scenarios"]}
+    print(f"\nComparison with {baseline_path}:")
+    for result in current:
+        before = baseline.get(result["scenario"])
+        if before:
+            change = (result["wall_seconds_mean"] / before["wall_seconds_mean"] - 1) * 100
+            print(
+                f"  {result['scenario']:<12} {before['wall_seconds_mean']:.2f}s -> "
+                f"{result['wall_seconds_mean']:.2f}s ({change:+.1f}%)"
+            )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline deepQuest benchmarks.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario to run (repeatable)")
+    parser.add_argument("--runs", type=int, default=3, help="research runs per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="runs executed at the same time")
+    parser.add_argument("--llm-latency", type=float, help="override the fake LLM base latency in seconds")
+    parser.add_argument("--trace-memory", action="store_true", help="also report tracemalloc peak (slows the run)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    results = []
+    with FakeServices() as services:
+        configure_environment(services.base_url, os.path.join(RESULTS_DIR, "traces"))
+        install_fakes(services.base_url)
+        for name in args.scenario or SCENARIOS:
+            services.config = SCENARIOS[name]
+            if args.llm_latency is not None:
+                services.config.llm_latency = args.llm_latency
+            result = run_scenario(name, services, args.runs, args.concurrency, args.trace_memory)
+            results.append(result)
+            print(
+                f"{name:<12} wall {result['wall_seconds_mean']:.2f}s (p50 {result['wall_seconds_p50']:.2f}s) "
+                f"plan {result['stage_seconds_mean']['plan_seconds']:.2f}s "
+                f"steps {result['stage_seconds_mean']['steps_seconds']:.2f}s "
+                f"report {result['stage_seconds_mean']['report_seconds']:.2f}s "
+                f"| {result['runs_per_minute']:.1f} runs/min | peak RSS {result['peak_rss_mb']:.0f} MB"
+            )
+
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "scenarios": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
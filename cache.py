@@ -0,0 +1,429 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from dotenv import load_dotenv
+
+from http_client import get_async_pool
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL")
+# Size cap of each disk cache directory; the entries closest to expiry are evicted first.
+DISK_CACHE_MAX_MB = float(os.getenv("DISK_CACHE_MAX_MB", "500"))
+# Expired entries and any excess over the size cap are removed every this many writes.
+DISK_CACHE_SWEEP_WRITES = int(os.getenv("DISK_CACHE_SWEEP_WRITES", "256"))
+
+# --- Storage Backends ---
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU mapping with optional per-entry expiry."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskBackend:
+    """Stores JSON values as one file per key under a directory.
+
+    Each file's mtime is set to its expiry time, so sweeps can drop expired
+    entries and evict down to ``max_mb`` from directory metadata alone. The
+    directory is created on first write.
+    """
+
+    def __init__(self, directory, max_mb=DISK_CACHE_MAX_MB, sweep_writes=DISK_CACHE_SWEEP_WRITES):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 2**20)
+        self.sweep_writes = sweep_writes
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if item.get("expires_at") and item["expires_at"] < time.time():
+            self.delete(key)
+            return None
+        return item.get("value")
+
+    def set(self, key, value, ttl=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        expires_at = time.time() + ttl if ttl else None
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"value": value, "expires_at": expires_at}, f)
+        # Entries without a TTL sort by write time against the others' expiry times.
+        mtime = expires_at or time.time()
+        os.utime(tmp_path, (mtime, mtime))
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self.sweep_writes == 1 or self.sweep_writes <= 1
+        if sweep:
+            self.sweep()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def sweep(self):
+        """Delete expired entries, then the soonest-expiring ones until under the size cap."""
+        now = time.time()
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if item.name.endswith(".json"):
+                        stat = item.stat()
+                        entries.append((stat.st_mtime, stat.st_size, item.path))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= now and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logging.info(f"Disk cache {self.directory}: evicted {removed} entries, {total // 2**20} MB kept")
+
+
+class RedisBackend:
+    """Stores JSON values in Redis under a key prefix."""
+
+    def __init__(self, url=REDIS_URL, prefix="deepquest:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def make_backend(name, directory=None, prefix="deepquest:"):
+    """Build a shared backend by name ("memory", "disk" or "redis"); None means memory only."""
+    if name == "disk":
+        return DiskBackend(directory or os.path.join(".cache", prefix.strip(":")))
+    if name == "redis":
+        try:
+            backend = RedisBackend(prefix=prefix)
+            backend.client.ping()
+            return backend
+        except Exception as e:
+            logging.warning(f"Redis cache unavailable, using memory only: {e}")
+    return None
+
+
+# --- Crawl Cache ---
+
+CRAWL_CACHE_BACKEND = os.getenv("CRAWL_CACHE_BACKEND", "disk")
+CRAWL_CACHE_DIR = os.getenv("CRAWL_CACHE_DIR", os.path.join(".cache", "crawl"))
+# How long an entry is served without revalidation, in seconds.
+CRAWL_CACHE_TTL = int(os.getenv("CRAWL_CACHE_TTL", "3600"))
+# How long an entry is kept for conditional revalidation, in seconds.
+CRAWL_CACHE_RETENTION = int(os.getenv("CRAWL_CACHE_RETENTION", str(7 * 24 * 3600)))
+
+TRACKING_PARAMS = ("utm_", "gclid", "fbclid", "mc_cid", "mc_eid")
+
+
+def normalize_url(url):
+    """Canonicalize a URL so that trivially different spellings share a cache entry."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not (scheme == "http" and parts.port == 80 or scheme == "https" and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = urlencode(
+        sorted(
+            (k, v)
+            for k, v in parse_qsl(parts.query, keep_blank_values=True)
+            if not k.lower().startswith(TRACKING_PARAMS)
+        )
+    )
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class CrawlCache:
+    """Crawl results keyed by normalized URL, with conditional revalidation.
+
+    URL entries hold the validators (ETag/Last-Modified) and point at the
+    content by its SHA-256, so identical pages reached through different URLs
+    are stored once. Lookups go to the in-memory LRU first, then the shared
+    backend.
+    """
+
+    def __init__(self, backend=None, ttl=CRAWL_CACHE_TTL, retention=CRAWL_CACHE_RETENTION, max_entries=512):
+        self.backend = backend
+        self.ttl = ttl
+        self.retention = retention
+        self.memory = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "refetched": 0, "stores": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _read(self, key):
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                logging.warning(f"Crawl cache backend read failed: {e}")
+            if value is not None:
+                self.memory.set(key, value, self.retention)
+        return value
+
+    def _write(self, key, value):
+        self.memory.set(key, value, self.retention)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, self.retention)
+            except Exception as e:
+                logging.warning(f"Crawl cache backend write failed: {e}")
+
+    def get(self, url, kind="markdown"):
+        """Return the cached entry for a URL with its content, or None."""
+        entry = self._read(f"url:{kind}:{normalize_url(url)}")
+        if entry is None:
+            return None
+        content = self._read(f"content:{entry['content_hash']}")
+        if content is None:
+            return None
+        return {**entry, "content": content}
+
+    def put(self, url, content, headers=None, kind="markdown"):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        self._write(f"content:{content_hash}", content)
+        self._write(
+            f"url:{kind}:{normalize_url(url)}",
+            {
+                "url": url,
+                "content_hash": content_hash,
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+                "fetched_at": time.time(),
+            },
+        )
+        self._count("stores")
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    async def revalidate(self, url, entry, timeout=10):
+        """Send a conditional GET; return True if the server answered 304 Not Modified."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if not headers:
+            return False
+
+        async def conditional_get(session):
+            async with session.get(url, headers=headers, timeout=timeout, allow_redirects=True) as response:
+                return response.status == 304
+
+        try:
+            return await get_async_pool().run(conditional_get)
+        except Exception as e:
+            logging.warning(f"Revalidation failed for {url}: {e}")
+            return False
+
+    async def fetch(self, url, fetch, kind="markdown"):
+        """Return content for a URL, calling ``fetch()`` only on a miss or a changed page.
+
+        ``fetch`` is a coroutine function returning ``(content, headers)``; a
+        ``None`` content is passed through and not cached.
+        """
+        entry = self.get(url, kind)
+        if entry is not None:
+            if self.is_fresh(entry):
+                self._count("hits")
+                return entry["content"]
+            self._count("stale")
+            if await self.revalidate(url, entry):
+                self._count("revalidated")
+                content = entry.pop("content")
+                entry["fetched_at"] = time.time()
+                # Both entries get a fresh retention, or the content could expire under a live URL entry.
+                self._write(f"content:{entry['content_hash']}", content)
+                self._write(f"url:{kind}:{normalize_url(url)}", entry)
+                return content
+            self._count("refetched")
+        else:
+            self._count("misses")
+        content, headers = await fetch()
+        if content is not None:
+            self.put(url, content, headers, kind)
+        return content
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"] + counters["stale"]
+        counters["hit_rate"] = (counters["hits"] + counters["revalidated"]) / lookups if lookups else 0.0
+        return counters
+
+
+crawl_cache = CrawlCache(make_backend(CRAWL_CACHE_BACKEND, CRAWL_CACHE_DIR, prefix="deepquest:crawl:"))
+
+
+# --- Search Result Cache ---
+
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+# Per-provider TTLs in seconds: news goes stale quickly, papers and
+# encyclopedia entries hardly at all.
+SEARCH_CACHE_TTLS = {
+    "Google": 6 * 3600,
+    "NewsAPI": 15 * 60,
+    "ArXiv": 7 * 24 * 3600,
+    "SEC": 24 * 3600,
+    "Wikipedia": 7 * 24 * 3600,
+}
+for _provider in SEARCH_CACHE_TTLS:
+    _override = os.getenv(f"SEARCH_CACHE_TTL_{_provider.upper()}")
+    if _override:
+        SEARCH_CACHE_TTLS[_provider] = int(_override)
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in into is it of on or over the "
+    "to was what when where which who why with about between vs versus".split()
+)
+
+
+def normalize_query(query):
+    """Lower-case, strip punctuation and stopwords, and collapse whitespace."""
+    words = "".join(c if c.isalnum() else " " for c in query.lower()).split()
+    kept = [w for w in words if w not in STOPWORDS]
+    return " ".join(kept or words)
+
+
+class SearchResultCache:
+    """Raw provider payloads keyed by provider and normalized query."""
+
+    def __init__(self, backend=None, ttls=None, max_entries=2048):
+        self.backend = backend
+        self.ttls = dict(SEARCH_CACHE_TTLS if ttls is None else ttls)
+        self.memory = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def _count(self, provider, name):
+        with self._lock:
+            provider_counters = self.counters.setdefault(provider, {"hits": 0, "misses": 0})
+            provider_counters[name] += 1
+
+    def key(self, provider, query):
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"search:{provider}:{digest}"
+
+    def get(self, provider, query):
+        key = self.key(provider, query)
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                logging.warning(f"Search cache backend read failed: {e}")
+            if value is not None:
+                self.memory.set(key, value, self.ttls.get(provider))
+        return value
+
+    def set(self, provider, query, value):
+        key = self.key(provider, query)
+        ttl = self.ttls.get(provider)
+        self.memory.set(key, value, ttl)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, ttl)
+            except Exception as e:
+                logging.warning(f"Search cache backend write failed: {e}")
+
+    def get_or_call(self, provider, query, call, should_cache=None):
+        """Return the cached payload or ``call()`` it and cache the result.
+
+        Payloads must be JSON-serializable. Exceptions from ``call`` propagate
+        and nothing is cached; ``should_cache`` can veto caching a payload.
+        """
+        if not self.ttls.get(provider):
+            return call()
+        value = self.get(provider, query)
+        if value is not None:
+            self._count(provider, "hits")
+            return value
+        self._count(provider, "misses")
+        value = call()
+        if value is not None and (should_cache is None or should_cache(value)):
+            self.set(provider, query, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {provider: dict(c) for provider, c in self.counters.items()}
+
+
+search_cache = SearchResultCache(make_backend(SEARCH_CACHE_BACKEND, prefix="deepquest:search:"))
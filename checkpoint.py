@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite file holding checkpoints of research runs.
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(".cache", "checkpoints.sqlite3"))
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+# Runs untouched for longer than this are deleted.
+CHECKPOINT_MAX_AGE_DAYS = float(os.getenv("CHECKPOINT_MAX_AGE_DAYS", "14"))
+# Oldest runs are deleted once the stored results exceed this size.
+CHECKPOINT_MAX_MB = float(os.getenv("CHECKPOINT_MAX_MB", "200"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    options TEXT,
+    status TEXT NOT NULL,
+    steps TEXT,
+    deps TEXT,
+    report TEXT,
+    replan_rounds INTEGER DEFAULT 0,
+    replan_limit_reached INTEGER DEFAULT 0,
+    replan_stats TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    result TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (run_id, idx)
+);
+CREATE TABLE IF NOT EXISTS replans (
+    run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    round INTEGER NOT NULL,
+    after_steps INTEGER NOT NULL,
+    added_steps TEXT NOT NULL,
+    limit_reached INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_updated_at ON runs(updated_at);
+"""
+
+
+class CheckpointStore:
+    """Durable record of research runs: plan, completed steps, replans and report.
+
+    Every write is committed straight away, so a crash loses at most the step
+    that was running. Safe to share between threads.
+    """
+
+    def __init__(self, path=CHECKPOINT_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            # auto_vacuum only takes effect on a new database file.
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            # Databases created before replan_stats existed get the column added.
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(runs)")}
+            if "replan_stats" not in columns:
+                self._conn.execute("ALTER TABLE runs ADD COLUMN replan_stats TEXT")
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- Writes ---
+
+    def start_run(self, run_id, query, options=None):
+        now = time.time()
+        self._execute(
+            "INSERT INTO runs (run_id, query, options, status, created_at, updated_at) VALUES (?, ?, ?, 'running', ?, ?) "
+            "ON CONFLICT(run_id) DO UPDATE SET status = 'running', updated_at = excluded.updated_at",
+            (run_id, query, json.dumps(options or {}), now, now),
+        )
+
+    def save_plan(self, run_id, steps, deps):
+        self._execute(
+            "UPDATE runs SET steps = ?, deps = ?, updated_at = ? WHERE run_id = ?",
+            (json.dumps(steps), json.dumps(deps), time.time(), run_id),
+        )
+
+    def save_step(self, run_id, idx, step, result):
+        self._execute(
+            "INSERT OR REPLACE INTO steps (run_id, idx, step, result, completed_at) VALUES (?, ?, ?, ?, ?)",
+            (run_id, idx, step, result, time.time()),
+        )
+
+    def save_replan(self, run_id, rounds, after_steps, added_steps, limit_reached):
+        """Record one replan decision; ``added_steps`` may be empty."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO replans (run_id, round, after_steps, added_steps, limit_reached, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, rounds, after_steps, json.dumps(added_steps), int(limit_reached), now),
+            )
+            self._conn.execute(
+                "UPDATE runs SET replan_rounds = ?, replan_limit_reached = ?, updated_at = ? WHERE run_id = ?",
+                (rounds, int(limit_reached), now, run_id),
+            )
+
+    def finish_run(self, run_id, status, report=None, replan_stats=None):
+        self._execute(
+            "UPDATE runs SET status = ?, report = COALESCE(?, report), "
+            "replan_stats = COALESCE(?, replan_stats), updated_at = ? WHERE run_id = ?",
+            (status, report, json.dumps(replan_stats) if replan_stats else None, time.time(), run_id),
+        )
+
+    # --- Reads ---
+
+    def load_run(self, run_id):
+        """The stored run as a dict with its completed steps in completion order, or None."""
+        rows = self._execute("SELECT * FROM runs WHERE run_id = ?", (run_id,))
+        if not rows:
+            return None
+        run = dict(rows[0])
+        run["options"] = json.loads(run["options"] or "{}")
+        run["steps"] = json.loads(run["steps"] or "[]")
+        run["deps"] = json.loads(run["deps"] or "[]")
+        run["replan_limit_reached"] = bool(run["replan_limit_reached"])
+        run["replan_stats"] = json.loads(run["replan_stats"] or "{}")
+        run["completed"] = [
+            (row["idx"], row["step"], row["result"])
+            for row in self._execute(
+                "SELECT idx, step, result FROM steps WHERE run_id = ? ORDER BY completed_at, idx", (run_id,)
+            )
+        ]
+        return run
+
+    def list_runs(self, status=None, limit=50):
+        sql = "SELECT run_id, query, status, created_at, updated_at FROM runs"
+        params = ()
+        if status:
+            sql += " WHERE status = ?"
+            params = (status,)
+        return [dict(row) for row in self._execute(sql + " ORDER BY updated_at DESC LIMIT ?", params + (limit,))]
+
+    # --- Garbage Collection ---
+
+    def gc(self, max_age_days=CHECKPOINT_MAX_AGE_DAYS, max_mb=CHECKPOINT_MAX_MB):
+        """Delete runs older than ``max_age_days``, then the oldest until under ``max_mb``."""
+        deleted = self._execute(
+            "DELETE FROM runs WHERE updated_at < ? RETURNING run_id", (time.time() - max_age_days * 86400,)
+        )
+        sizes = self._execute(
+            "SELECT r.run_id, LENGTH(COALESCE(r.report, '')) + LENGTH(COALESCE(r.steps, '')) "
+            "+ COALESCE(SUM(LENGTH(s.result)), 0) AS size "
+            "FROM runs r LEFT JOIN steps s ON s.run_id = r.run_id "
+            "WHERE r.status != 'running' GROUP BY r.run_id ORDER BY r.updated_at"
+        )
+        total = sum(row["size"] for row in sizes)
+        limit = max_mb * 2**20
+        for row in sizes:
+            if total <= limit:
+                break
+            deleted += self._execute("DELETE FROM runs WHERE run_id = ? RETURNING run_id", (row["run_id"],))
+            total -= row["size"]
+        if deleted:
+            self._execute("PRAGMA incremental_vacuum")
+            logging.info(f"Checkpoint GC removed {len(deleted)} runs")
+        return len(deleted)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """The process-wide CheckpointStore; old runs are collected when it is opened."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+            try:
+                _store.gc()
+            except sqlite3.Error as e:
+                logging.warning(f"Checkpoint GC failed: {e}")
+        return _store
@@ -1,11 +1,238 @@
 from openai import AzureOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+import hashlib
+import json
+import logging
 import os
+import threading
+from types import SimpleNamespace
 from dotenv import load_dotenv
+from cache import LRUCache
+from ranking import estimate_tokens
+from ratelimit import get_rate_limiter
+from tracing import span
 
 load_dotenv()
 
-client = AzureOpenAI(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2025-03-01-preview",
+# LLM_CACHE_MODE is one of:
+#   off    - every call goes to Azure
+#   cache  - identical requests are served from an in-process LRU
+#   record - like cache, and every live response is appended to LLM_RECORD_FILE
+#   replay - responses come only from LLM_RECORD_FILE; a miss is an error
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "cache")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+LLM_RECORD_FILE = os.getenv("LLM_RECORD_FILE", "llm_recordings.jsonl")
+# Completion tokens reserved against AZURE_TPM when a request sets no max_tokens.
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "1000"))
+
+
+def _jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    return str(value)
+
+
+def request_key(kwargs):
+    """Hash the parts of a chat request that determine its response."""
+    # Streamed and plain requests share entries, so either can be answered from the other's recording.
+    payload = {k: v for k, v in kwargs.items() if k not in ("stream", "stream_options", "timeout")}
+    encoded = json.dumps(payload, sort_keys=True, default=_jsonable)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def estimate_request_tokens(kwargs):
+    """Tokens a chat request may use: its messages and tools plus the completion allowance."""
+    prompt = json.dumps([kwargs.get("messages"), kwargs.get("tools")], default=_jsonable)
+    completion = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or LLM_COMPLETION_ESTIMATE
+    return estimate_tokens(prompt) + completion
+
+
+class CachedCompletions:
+    """Drop-in for ``client.chat.completions`` that memoizes and records responses."""
+
+    def __init__(self, completions, mode=LLM_CACHE_MODE, max_entries=LLM_CACHE_SIZE, record_file=LLM_RECORD_FILE):
+        self._completions = completions
+        self.mode = mode
+        self.record_file = record_file
+        self.cache = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "replayed": 0}
+        self._recordings = {}
+        if mode == "replay":
+            self._load_recordings()
+
+    def _load_recordings(self):
+        if not os.path.exists(self.record_file):
+            logging.warning(f"No LLM recordings found at {self.record_file}")
+            return
+        with open(self.record_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._recordings[record["key"]] = record["response"]
+
+    def _record(self, key, kwargs, data):
+        line = json.dumps({"key": key, "model": kwargs.get("model"), "response": data})
+        with self._lock:
+            with open(self.record_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _live(self, **kwargs):
+        """Call Azure once the shared rate limiter admits the request."""
+        limiter = get_rate_limiter()
+        estimate = estimate_request_tokens(kwargs)
+        limiter.acquire({"azure:requests": 1, "azure:tokens": estimate})
+        if kwargs.get("stream"):
+            # The last chunk then carries the usage the reservation is settled against.
+            stream_options = {**(kwargs.get("stream_options") or {}), "include_usage": True}
+            stream = self._completions.create(**{**kwargs, "stream_options": stream_options})
+            return self._settle_stream(stream, limiter, estimate)
+        response = self._completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            # Settle the reservation against what the call actually used.
+            limiter.adjust("azure:tokens", usage.total_tokens - estimate)
+        return response
+
+    def _settle_stream(self, stream, limiter, estimate):
+        for chunk in stream:
+            if chunk.usage is not None:
+                limiter.adjust("azure:tokens", chunk.usage.total_tokens - estimate)
+            yield chunk
+
+    def create(self, **kwargs):
+        if kwargs.get("stream"):
+            # Streaming callers trace the whole stream themselves.
+            return self._create_stream(**kwargs)
+        with span(kwargs.get("model", "chat"), "llm", model=kwargs.get("model")) as llm_span:
+            response, source = self._create(**kwargs)
+            llm_span.set(source=source)
+            usage = getattr(response, "usage", None)
+            if source == "live" and usage is not None:
+                llm_span.set(
+                    prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens,
+                )
+            return response
+
+    def _create(self, **kwargs):
+        """Return (response, source) where source is live, cache or replay."""
+        if self.mode == "off":
+            return self._live(**kwargs), "live"
+
+        key = request_key(kwargs)
+        if self.mode == "replay":
+            data = self._recordings.get(key)
+            if data is None:
+                raise LookupError(f"No recorded LLM response for request {key[:12]}")
+            self._count("replayed")
+            return ChatCompletion.model_validate(data), "replay"
+
+        data = self.cache.get(key)
+        if data is not None:
+            self._count("hits")
+            return ChatCompletion.model_validate(data), "cache"
+
+        self._count("misses")
+        response = self._live(**kwargs)
+        data = response.model_dump()
+        self.cache.set(key, data)
+        if self.mode == "record":
+            self._record(key, kwargs, data)
+        return response, "live"
+
+    def _create_stream(self, **kwargs):
+        """Stream live, or replay a cached or recorded response as a single chunk."""
+        if self.mode == "off":
+            return self._live(**kwargs)
+        key = request_key(kwargs)
+        if self.mode == "replay":
+            data = self._recordings.get(key)
+            if data is None:
+                raise LookupError(f"No recorded LLM response for request {key[:12]}")
+            self._count("replayed")
+            return iter([_as_chunk(data)])
+        data = self.cache.get(key)
+        if data is not None:
+            self._count("hits")
+            return iter([_as_chunk(data)])
+        self._count("misses")
+        return self._store_stream(key, kwargs, self._live(**kwargs))
+
+    def _store_stream(self, key, kwargs, stream):
+        """Pass ``stream`` through, then cache (and record) it as one completion once it ends."""
+        parts, first, usage = [], None, None
+        for chunk in stream:
+            first = first or chunk
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        if first is None:
+            return
+        data = ChatCompletion.model_validate(
+            {
+                "id": first.id,
+                "object": "chat.completion",
+                "created": first.created,
+                "model": first.model,
+                "choices": [
+                    {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(parts)}}
+                ],
+                "usage": usage.model_dump() if usage is not None else None,
+            }
+        ).model_dump()
+        self.cache.set(key, data)
+        if self.mode == "record":
+            self._record(key, kwargs, data)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+def _as_chunk(data):
+    """A stored chat completion as the one chunk of a stream, usage included."""
+    completion = ChatCompletion.model_validate(data)
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": completion.id,
+            "object": "chat.completion.chunk",
+            "created": completion.created,
+            "model": completion.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "delta": {"role": "assistant", "content": completion.choices[0].message.content or ""},
+                }
+            ],
+            "usage": completion.usage.model_dump() if completion.usage is not None else None,
+        }
+    )
+
+
+class CachedClient:
+    """Wraps an OpenAI client so that ``chat.completions.create`` goes through the cache."""
+
+    def __init__(self, client, **cache_options):
+        self._client = client
+        self.chat = SimpleNamespace(
+            completions=CachedCompletions(client.chat.completions, **cache_options)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+client = CachedClient(
+    AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2025-03-01-preview",
+    )
 )
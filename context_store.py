@@ -0,0 +1,109 @@
+import logging
+import os
+import re
+import threading
+
+from ranking import BM25Index, chunk_text, estimate_tokens, pack_passages
+
+# Token budgets for the context handed to each kind of LLM call.
+STEP_CONTEXT_TOKENS = int(os.getenv("STEP_CONTEXT_TOKENS", "4000"))
+REPLAN_CONTEXT_TOKENS = int(os.getenv("REPLAN_CONTEXT_TOKENS", "3000"))
+REPORT_CONTEXT_TOKENS = int(os.getenv("REPORT_CONTEXT_TOKENS", "24000"))
+# Words of each step result kept in the rolling summary.
+SUMMARY_WORDS_PER_STEP = int(os.getenv("SUMMARY_WORDS_PER_STEP", "40"))
+
+
+def summarize_result(result, max_words=SUMMARY_WORDS_PER_STEP):
+    """Leading sentences of a step result, capped at ``max_words`` words."""
+    words = re.sub(r"[#*_>`|]+", " ", result).split()
+    summary = " ".join(words[:max_words])
+    return summary + ("..." if len(words) > max_words else "")
+
+
+class ContextStore:
+    """Indexes completed step results and hands each call only what it needs.
+
+    Every call gets a rolling one-line-per-step summary plus the BM25-ranked
+    passages most relevant to that call, packed under a token budget.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self._passages = []
+        self._passage_steps = []
+        self._index = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "full_tokens": 0, "sent_tokens": 0}
+
+    def add(self, step, result, step_id=None):
+        """Record a completed step; ``step_id`` defaults to its completion order."""
+        with self._lock:
+            step_id = len(self.steps) if step_id is None else step_id
+            self.steps.append((step_id, step, result))
+            for chunk in chunk_text(result):
+                self._passages.append(chunk)
+                self._passage_steps.append(step_id)
+            self._index = None
+        return step_id
+
+    def full_text(self, step_ids=None):
+        """The complete, unselected context in the original ``Step/Result`` format."""
+        return "".join(
+            f"\nStep: {step}\nResult: {result}\n"
+            for step_id, step, result in self.steps
+            if step_ids is None or step_id in step_ids
+        )
+
+    def summary(self, step_ids=None):
+        return "\n".join(
+            f"- {step}: {summarize_result(result)}"
+            for step_id, step, result in self.steps
+            if step_ids is None or step_id in step_ids
+        )
+
+    def select(self, query, token_budget=STEP_CONTEXT_TOKENS, step_ids=None):
+        """Return the rolling summary plus the passages most relevant to ``query``.
+
+        ``step_ids`` restricts selection to the given steps (for example a
+        step's ancestors). Falls back to the full text when it already fits.
+        """
+        with self._lock:
+            full = self.full_text(step_ids)
+            full_tokens = estimate_tokens(full) if full else 0
+            if full_tokens <= token_budget:
+                selected = full
+            else:
+                summary = self.summary(step_ids)
+                if self._index is None:
+                    self._index = BM25Index(self._passages)
+                candidates = [
+                    idx
+                    for idx in self._index.top(query)
+                    if step_ids is None or self._passage_steps[idx] in step_ids
+                ]
+                remaining = max(token_budget - estimate_tokens(summary), 0)
+                chosen = sorted(pack_passages(self._passages, candidates, remaining))
+                step_names = {step_id: step for step_id, step, _ in self.steps}
+                passages = "\n\n".join(
+                    f"[From step: {step_names[self._passage_steps[idx]]}]\n{self._passages[idx]}"
+                    for idx in chosen
+                )
+                selected = (
+                    f"Summary of completed steps:\n{summary}\n\n"
+                    f"Most relevant findings:\n{passages}"
+                )
+
+            sent_tokens = estimate_tokens(selected) if selected else 0
+            self.stats["calls"] += 1
+            self.stats["full_tokens"] += full_tokens
+            self.stats["sent_tokens"] += sent_tokens
+        if full_tokens > sent_tokens:
+            logging.info(
+                f"Context selection saved {full_tokens - sent_tokens} tokens "
+                f"({sent_tokens}/{full_tokens} sent)"
+            )
+        return selected
+
+    def savings(self):
+        """Cumulative tokens saved by selection across all calls."""
+        return self.stats["full_tokens"] - self.stats["sent_tokens"]
@@ -0,0 +1,183 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from crawl4ai import AsyncWebCrawler, CrawlerRunConfig
+
+from extract import BOILERPLATE_TAGS
+
+# Pool sizing, overridable from the environment.
+CRAWLER_MAX_CONCURRENCY = int(os.getenv("CRAWLER_MAX_CONCURRENCY", "6"))
+CRAWLER_PER_HOST_LIMIT = int(os.getenv("CRAWLER_PER_HOST_LIMIT", "2"))
+
+
+class CrawlerPool:
+    """A long-lived AsyncWebCrawler shared by every search in the process.
+
+    The browser runs on its own event loop in a background thread, so callers
+    on any thread or event loop can submit page loads without paying for a
+    browser launch. Concurrency is bounded both overall and per host.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=CRAWLER_MAX_CONCURRENCY,
+        per_host_limit=CRAWLER_PER_HOST_LIMIT,
+        crawler_factory=AsyncWebCrawler,
+        run_config=None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.crawler_factory = crawler_factory
+        self.run_config = run_config
+        self.per_host_limit = per_host_limit
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._crawler = None
+        self._ready = None
+        self._global_semaphore = None
+        self._host_semaphores = {}
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._launches = 0
+        self._timings = deque(maxlen=500)
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Start the background loop and warm up the browser (idempotent)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever, name="crawler-pool", daemon=True
+            )
+            self._thread.start()
+            self._ready = asyncio.run_coroutine_threadsafe(self._warm_up(), self._loop)
+
+    async def _warm_up(self):
+        self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._host_semaphores = {}
+        crawler = self.crawler_factory()
+        await crawler.__aenter__()
+        self._crawler = crawler
+        self._launches += 1
+        logging.info("Crawler pool warmed up")
+
+    async def _close(self):
+        if self._crawler is not None:
+            try:
+                await self._crawler.__aexit__(None, None, None)
+            finally:
+                self._crawler = None
+
+    def shutdown(self, timeout=10):
+        """Close the browser and stop the background loop."""
+        with self._lock:
+            if self._thread is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout)
+            except Exception as e:
+                logging.error(f"Error closing crawler pool: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+            self._ready = None
+            logging.info("Crawler pool shut down")
+
+    # --- Crawling ---
+
+    async def _crawl(self, url):
+        host = urlparse(url).netloc.lower()
+        host_semaphore = self._host_semaphores.setdefault(
+            host, asyncio.Semaphore(self.per_host_limit)
+        )
+        self._queued += 1
+        dequeued = False
+        try:
+            async with self._global_semaphore, host_semaphore:
+                self._queued -= 1
+                dequeued = True
+                self._active += 1
+                started = time.perf_counter()
+                try:
+                    if self.run_config is not None:
+                        result = await self._crawler.arun(url=url, config=self.run_config)
+                    else:
+                        result = await self._crawler.arun(url=url)
+                    self._completed += 1
+                    return result
+                except Exception:
+                    self._failed += 1
+                    raise
+                finally:
+                    self._active -= 1
+                    self._timings.append(time.perf_counter() - started)
+        finally:
+            if not dequeued:
+                self._queued -= 1
+
+    async def arun(self, url):
+        """Crawl one URL on the shared browser; awaitable from any event loop."""
+        self.start()
+        try:
+            await asyncio.wrap_future(self._ready)
+        except Exception:
+            # Allow the next call to retry the browser launch.
+            self.shutdown()
+            raise
+        future = asyncio.run_coroutine_threadsafe(self._crawl(url), self._loop)
+        return await asyncio.wrap_future(future)
+
+    # --- Metrics ---
+
+    def stats(self):
+        """Return queue depth, in-flight count and page-load timings in seconds."""
+        timings = sorted(self._timings)
+        count = len(timings)
+        return {
+            "queue_depth": self._queued,
+            "active": self._active,
+            "completed": self._completed,
+            "failed": self._failed,
+            "browser_launches": self._launches,
+            "page_load_avg": sum(timings) / count if count else 0.0,
+            "page_load_p50": timings[count // 2] if count else 0.0,
+            "page_load_p95": timings[min(count - 1, int(count * 0.95))] if count else 0.0,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_crawler_pool():
+    """Return the process-wide crawler pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Site chrome is dropped in the browser, before markdown conversion.
+            _pool = CrawlerPool(run_config=CrawlerRunConfig(excluded_tags=list(BOILERPLATE_TAGS)))
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def set_crawler_pool(pool):
+    """Replace the process-wide crawler pool (for example with a non-browser crawler)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = pool
+        atexit.register(pool.shutdown)
@@ -0,0 +1,163 @@
+import contextvars
+import hashlib
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from cache import normalize_url
+from ranking import estimate_tokens
+from tracing import add_counts
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+# Pages whose 64-bit SimHashes differ in at most this many bits are duplicates.
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))
+# Shorter pages are too small for a reliable fingerprint.
+DEDUP_MIN_WORDS = 50
+
+SHINGLE_WORDS = 3
+BANDS = 4  # distance <= 3 leaves at least one 16-bit band identical
+
+WORD_PATTERN = re.compile(r"\w+")
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+_current_index = contextvars.ContextVar("dedup_index", default=None)
+# (step id, ids of the steps whose results the step sees) of the step being executed.
+_current_step = contextvars.ContextVar("dedup_step", default=None)
+
+
+def simhash(text):
+    """64-bit SimHash of the word 3-shingles of ``text``; None for very short text."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < DEDUP_MIN_WORDS:
+        return None
+    shingles = {" ".join(words[i : i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # Each bit of the fingerprint is the majority vote of that bit over all shingles.
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    return int(np.packbits(votes[::-1].astype(np.uint8)).view(">u8")[0])
+
+
+def _visible(owner):
+    """Whether content fetched by step ``owner`` is in the current step's context."""
+    step = _current_step.get()
+    if step is None or owner is None:
+        return False
+    step_id, seen = step
+    return owner == step_id or owner in seen
+
+
+class DedupIndex:
+    """URLs fetched and fingerprints of pages seen, so repeats are not sent to the LLM twice.
+
+    A repeat is only replaced by a reference when an earlier copy is in the
+    current step's context: fetched by the step itself or by one of its
+    ancestors in the same run. Anywhere else the page is passed on again,
+    usually straight from the crawl cache.
+
+    Near duplicates are looked up by 16-bit bands of the SimHash; two
+    fingerprints within DEDUP_MAX_DISTANCE bits always share a band.
+    """
+
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._urls = {}
+        self._bands = [{} for _ in range(BANDS)]
+        self._lock = threading.Lock()
+        # Every skipped URL is a crawl that did not happen.
+        self.counters = {"urls_skipped": 0, "near_duplicates": 0, "tokens_saved": 0}
+
+    def claim_url(self, url):
+        """Return True if ``url`` was fetched into the current step's context; otherwise register it and return False."""
+        key = normalize_url(url)
+        with self._lock:
+            record = self._urls.setdefault(key, {"owners": set(), "tokens": 0, "claimant": _current_owner()})
+            if not any(_visible(owner) for owner in record["owners"]):
+                return False
+            tokens = record["tokens"]
+            self.counters["urls_skipped"] += 1
+            self.counters["tokens_saved"] += tokens
+        add_counts(dedup_fetches_saved=1, dedup_tokens_saved=tokens)
+        return True
+
+    def release_url(self, url):
+        """Forget a URL whose fetch by the current step failed, so a later step may retry it."""
+        key = normalize_url(url)
+        with self._lock:
+            record = self._urls.get(key)
+            if record is not None and not record["owners"] and record["claimant"] == _current_owner():
+                del self._urls[key]
+
+    def find_duplicate(self, url, text):
+        """Return the URL of a near-identical page in the current step's context, or register ``text`` and return None."""
+        tokens = estimate_tokens(text)
+        fingerprint = simhash(text)
+        bands = [(fingerprint >> (16 * b)) & 0xFFFF for b in range(BANDS)] if fingerprint is not None else []
+        owner = _current_owner()
+        with self._lock:
+            record = self._urls.setdefault(normalize_url(url), {"owners": set(), "tokens": 0, "claimant": owner})
+            new_page = not record["owners"]
+            # Later skips of this URL save what its content would have cost.
+            record["tokens"] = tokens
+            record["owners"].add(owner)
+            for b, band in enumerate(bands):
+                for other, other_url in self._bands[b].get(band, ()):
+                    if (
+                        other_url != url
+                        and bin(fingerprint ^ other).count("1") <= self.max_distance
+                        and any(_visible(o) for o in self._urls[normalize_url(other_url)]["owners"])
+                    ):
+                        self.counters["near_duplicates"] += 1
+                        self.counters["tokens_saved"] += tokens
+                        add_counts(dedup_tokens_saved=tokens)
+                        return other_url
+            if new_page:
+                for b, band in enumerate(bands):
+                    self._bands[b].setdefault(band, []).append((fingerprint, url))
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "urls_seen": len(self._urls)}
+
+
+def _current_owner():
+    step = _current_step.get()
+    return step[0] if step is not None else None
+
+
+@contextmanager
+def dedup_scope(enabled=DEDUP_ENABLED):
+    """Make a fresh DedupIndex current for the block; yields it (or None when disabled)."""
+    if not enabled:
+        yield None
+        return
+    index = DedupIndex()
+    token = _current_index.set(index)
+    try:
+        yield index
+    finally:
+        _current_index.reset(token)
+        logging.info(f"Dedup stats: {index.stats()}")
+
+
+@contextmanager
+def dedup_step(step_id, ancestor_ids):
+    """Mark the block as executing step ``step_id``, which sees the results of ``ancestor_ids``."""
+    token = _current_step.set((step_id, frozenset(ancestor_ids)))
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+def current_dedup_index():
+    return _current_index.get()
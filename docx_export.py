@@ -0,0 +1,201 @@
+import hashlib
+import os
+from io import BytesIO
+from xml.sax.saxutils import escape, quoteattr
+
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from markdown_it import MarkdownIt
+
+from cache import LRUCache
+
+# Rendered documents kept in memory, keyed by a hash of the report.
+DOCX_CACHE_SIZE = int(os.getenv("DOCX_CACHE_SIZE", "32"))
+DOCX_TITLE = "DeepQuest Research Report"
+
+_markdown = MarkdownIt("commonmark").enable(["table", "strikethrough"])
+_docx_cache = LRUCache(max_entries=DOCX_CACHE_SIZE)
+
+# Word's built-in list styles only go three levels deep.
+MAX_LIST_DEPTH = 3
+HYPERLINK_COLOR = "0563C1"
+CODE_FONT = '<w:rFonts w:ascii="Courier New" w:hAnsi="Courier New" w:cs="Courier New"/>'
+# Usable width of a default Letter page, in twentieths of a point.
+PAGE_WIDTH_TWIPS = 8640
+
+
+class _DocxRenderer:
+    """Builds WordprocessingML from one pass over a markdown-it token stream.
+
+    Paragraphs are emitted as XML text and parsed once at the end; going
+    through python-docx's object API per run is several times slower on long
+    reports.
+    """
+
+    def __init__(self, title):
+        self.doc = Document()
+        self.doc.add_heading(title, 0)
+        self.parts = []
+        self._style_ids = {}
+        self.lists = []  # "bullet" or "number" per open list
+        self.item_start = False
+        self.quote_depth = 0
+        self.table = None
+
+    def style_id(self, name):
+        # Looking styles up by name scans the whole style sheet; do it once.
+        if name not in self._style_ids:
+            self._style_ids[name] = self.doc.styles[name].style_id
+        return self._style_ids[name]
+
+    def block_style(self):
+        if self.lists:
+            depth = min(len(self.lists), MAX_LIST_DEPTH)
+            suffix = f" {depth}" if depth > 1 else ""
+            if self.item_start:
+                self.item_start = False
+                kind = "Bullet" if self.lists[-1] == "bullet" else "Number"
+                return self.style_id(f"List {kind}{suffix}")
+            return self.style_id(f"List Continue{suffix}")
+        if self.quote_depth:
+            return self.style_id("Quote")
+        return None
+
+    def paragraph(self, content, style=None):
+        properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+        return f"<w:p>{properties}{content}</w:p>"
+
+    def render(self, tokens):
+        out = self.parts
+        tokens = iter(tokens)
+        for token in tokens:
+            kind = token.type
+            if kind == "heading_open":
+                style = self.style_id(f"Heading {token.tag[1:]}")
+                out.append(self.paragraph(self.inline(next(tokens).children), style))
+            elif kind == "paragraph_open":
+                style = self.block_style()
+                out.append(self.paragraph(self.inline(next(tokens).children), style))
+            elif kind in ("bullet_list_open", "ordered_list_open"):
+                self.lists.append("bullet" if kind == "bullet_list_open" else "number")
+            elif kind in ("bullet_list_close", "ordered_list_close"):
+                self.lists.pop()
+            elif kind == "list_item_open":
+                self.item_start = True
+            elif kind == "blockquote_open":
+                self.quote_depth += 1
+            elif kind == "blockquote_close":
+                self.quote_depth -= 1
+            elif kind in ("fence", "code_block"):
+                lines = token.content.rstrip("\n").split("\n")
+                body = "<w:br/>".join(f'<w:t xml:space="preserve">{escape(line)}</w:t>' for line in lines)
+                out.append(self.paragraph(f'<w:r><w:rPr>{CODE_FONT}<w:sz w:val="18"/></w:rPr>{body}</w:r>', self.block_style()))
+            elif kind == "table_open":
+                self.table = []
+            elif kind == "tr_open":
+                self.table.append([])
+            elif kind == "inline" and self.table is not None:
+                self.table[-1].append(token.children)
+            elif kind == "table_close":
+                out.append(self.render_table(self.table))
+                self.table = None
+            elif kind == "html_block":
+                out.append(self.paragraph(self.run(token.content.strip()), self.block_style()))
+
+    def run(self, text, bold=False, italic=False, strike=False, code=False, link=False):
+        # Property order follows the w:rPr schema sequence.
+        properties = (
+            (CODE_FONT if code else "")
+            + ("<w:b/>" if bold else "")
+            + ("<w:i/>" if italic else "")
+            + ("<w:strike/>" if strike else "")
+            + (f'<w:color w:val="{HYPERLINK_COLOR}"/><w:u w:val="single"/>' if link else "")
+        )
+        properties = f"<w:rPr>{properties}</w:rPr>" if properties else ""
+        return f'<w:r>{properties}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+    def inline(self, children, bold=False):
+        out = []
+        italic = strike = False
+        link = None  # runs of the open hyperlink
+        for child in children or ():
+            kind = child.type
+            if kind == "text" or kind == "html_inline":
+                run = self.run(child.content, bold, italic, strike, link=link is not None)
+            elif kind == "code_inline":
+                run = self.run(child.content, bold, italic, strike, code=True, link=link is not None)
+            elif kind == "softbreak":
+                run = self.run(" ", link=link is not None)
+            elif kind == "hardbreak":
+                run = "<w:r><w:br/></w:r>"
+            elif kind == "image":
+                run = self.run(child.content or child.attrGet("alt") or "", bold, italic, strike)
+            else:
+                if kind == "strong_open" or kind == "strong_close":
+                    bold = kind == "strong_open"
+                elif kind == "em_open" or kind == "em_close":
+                    italic = kind == "em_open"
+                elif kind == "s_open" or kind == "s_close":
+                    strike = kind == "s_open"
+                elif kind == "link_open":
+                    link = (child.attrGet("href") or "", [])
+                elif kind == "link_close" and link is not None:
+                    out.append(self.hyperlink(*link))
+                    link = None
+                continue
+            (link[1] if link is not None else out).append(run)
+        return "".join(out)
+
+    def hyperlink(self, url, runs):
+        if not url:
+            return "".join(runs)
+        r_id = self.doc.part.relate_to(url, RELATIONSHIP_TYPE.HYPERLINK, is_external=True)
+        return f'<w:hyperlink r:id={quoteattr(r_id)}>{"".join(runs)}</w:hyperlink>'
+
+    def render_table(self, rows):
+        if not rows:
+            return ""
+        n_cols = max(len(row) for row in rows)
+        width = PAGE_WIDTH_TWIPS // n_cols
+        cell_props = f'<w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>'
+        out = [
+            f'<w:tbl><w:tblPr><w:tblStyle w:val="{self.style_id("Table Grid")}"/>'
+            '<w:tblW w:w="0" w:type="auto"/></w:tblPr><w:tblGrid>'
+            + f'<w:gridCol w:w="{width}"/>' * n_cols
+            + "</w:tblGrid>"
+        ]
+        for row_idx, row in enumerate(rows):
+            cells = [self.inline(children, bold=row_idx == 0) for children in row]
+            cells += [""] * (n_cols - len(cells))
+            out.append("<w:tr>" + "".join(f"<w:tc>{cell_props}<w:p>{cell}</w:p></w:tc>" for cell in cells) + "</w:tr>")
+        out.append("</w:tbl>")
+        return "".join(out)
+
+    def to_bytes(self):
+        body = self.doc.element.body
+        fragment = parse_xml(f"<w:body {nsdecls('w', 'r')}>{''.join(self.parts)}</w:body>")
+        # New blocks go before the trailing section properties.
+        section = body.sectPr
+        for element in list(fragment):
+            if section is not None:
+                section.addprevious(element)
+            else:
+                body.append(element)
+        buffer = BytesIO()
+        self.doc.save(buffer)
+        return buffer.getvalue()
+
+
+def markdown_to_docx(markdown_text, title=DOCX_TITLE):
+    """Render a markdown report as DOCX bytes, reusing the bytes of an identical report."""
+    key = hashlib.sha256(f"{title}\0{markdown_text}".encode("utf-8")).hexdigest()
+    cached = _docx_cache.get(key)
+    if cached is not None:
+        return cached
+    renderer = _DocxRenderer(title)
+    renderer.render(_markdown.parse(markdown_text))
+    data = renderer.to_bytes()
+    _docx_cache.set(key, data)
+    return data
@@ -0,0 +1,272 @@
+import logging
+import sqlite3
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from typing import Callable, Optional
+
+from checkpoint import CHECKPOINT_ENABLED, get_checkpoint_store
+from dedup import DEDUP_ENABLED, dedup_scope, dedup_step
+from context_store import (
+    ContextStore,
+    STEP_CONTEXT_TOKENS,
+    REPLAN_CONTEXT_TOKENS,
+    REPORT_CONTEXT_TOKENS,
+)
+from planner import plan_research_dag, ReplanPolicy, REPLAN_MODE
+from ratelimit import priority_scope
+from scheduler import ancestors, run_plan, MAX_PARALLEL_STEPS
+from source_selector import SOURCE_SELECTION_ENABLED, get_source_selector, source_scope
+from stepexecutor import execute_step
+from tracing import current_span, export_trace, span, start_trace
+from writer import report_writer, report_writer_sectioned, REPORT_MODE
+
+
+@dataclass
+class ResearchOptions:
+    """Tunable settings for one research run."""
+
+    max_steps: int = 20
+    max_replan_rounds: int = 3
+    max_parallel_steps: int = MAX_PARALLEL_STEPS
+    replan_mode: str = REPLAN_MODE
+    report_mode: str = REPORT_MODE
+    checkpoint: bool = CHECKPOINT_ENABLED
+    dedup: bool = DEDUP_ENABLED
+    priority: str = "interactive"  # rate limiter queue priority: interactive, report or batch
+    source_selection: bool = SOURCE_SELECTION_ENABLED
+
+
+@dataclass
+class ResearchCallbacks:
+    """Optional progress hooks; all are called on the thread running the research."""
+
+    on_plan: Optional[Callable] = None  # (steps, deps)
+    on_steps_started: Optional[Callable] = None  # (step indices)
+    on_step_complete: Optional[Callable] = None  # (idx, step, result, completed count, total steps)
+    on_plan_updated: Optional[Callable] = None  # (steps)
+    on_warning: Optional[Callable] = None  # (message)
+    on_report_update: Optional[Callable] = None  # (partial report markdown)
+
+
+@dataclass
+class ResearchState:
+    """Everything needed to resume a run: the plan, finished steps and the report."""
+
+    query: str
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    steps: list = field(default_factory=list)
+    deps: list = field(default_factory=list)
+    completed: dict = field(default_factory=dict)
+    context_store: ContextStore = field(default_factory=ContextStore)
+    report: Optional[str] = None
+    timings: dict = field(default_factory=dict)
+    replan_stats: dict = field(default_factory=dict)
+    dedup_stats: dict = field(default_factory=dict)
+    replan_rounds: int = 0
+    replan_limit_reached: bool = False
+    trace_file: Optional[str] = None
+    status: Optional[str] = None  # checkpoint status when loaded: running, done or failed
+
+
+def _call(callback, *args):
+    if callback:
+        callback(*args)
+
+
+class _Checkpointer:
+    """Writes run progress to the checkpoint store; storage errors never fail a run."""
+
+    def __init__(self, run_id, enabled):
+        self.run_id = run_id
+        self.store = get_checkpoint_store() if enabled else None
+
+    def __getattr__(self, method):
+        def write(*args):
+            if self.store is None:
+                return
+            try:
+                getattr(self.store, method)(self.run_id, *args)
+            except sqlite3.Error as e:
+                logging.warning(f"Checkpoint {method} failed for run {self.run_id}: {e}")
+
+        return write
+
+
+def load_research_state(run_id):
+    """Rebuild a checkpointed run; returns (state, options), or (None, None) if it is unknown.
+
+    The context store is refilled from the stored
+    results, so resuming makes no LLM or web calls for finished steps.
+    """
+    run = get_checkpoint_store().load_run(run_id)
+    if run is None:
+        return None, None
+    option_fields = {f.name for f in fields(ResearchOptions)}
+    options = ResearchOptions(**{k: v for k, v in run["options"].items() if k in option_fields})
+    state = ResearchState(
+        query=run["query"],
+        run_id=run_id,
+        steps=run["steps"],
+        deps=run["deps"],
+        report=run["report"],
+        replan_rounds=run["replan_rounds"],
+        replan_limit_reached=run["replan_limit_reached"],
+        status=run["status"],
+        replan_stats=run["replan_stats"],
+    )
+    for idx, step, result in run["completed"]:
+        state.completed[idx] = result
+        state.context_store.add(step, result, step_id=idx)
+    return state, options
+
+
+def run_research(query, options=None, callbacks=None, state=None):
+    """Plan, execute, replan and write a report for ``query`` without any UI.
+
+    Passing the ``state`` of an interrupted run resumes it: the plan and
+    completed steps are reused and only the remaining work is done. Progress
+    is checkpointed under ``state.run_id`` so ``resume_research`` can pick the
+    run up after a crash. Returns the final ResearchState. Errors from the LLM
+    or providers propagate.
+    """
+    options = options or ResearchOptions()
+    callbacks = callbacks or ResearchCallbacks()
+    state = state or ResearchState(query=query)
+    checkpoint = _Checkpointer(state.run_id, options.checkpoint)
+    checkpoint.start_run(query, asdict(options))
+    trace = None
+    status = "failed"
+    try:
+        with start_trace("research", query=query, run_id=state.run_id) as trace, dedup_scope(
+            options.dedup
+        ) as dedup, priority_scope(options.priority), source_scope(options.source_selection) as sources:
+            _run_research(query, options, callbacks, state, checkpoint)
+            if sources is not None and state.report:
+                # Providers whose results the report cited are called more often for similar steps.
+                get_source_selector().learn(sources.calls, state.report)
+            state.dedup_stats = dedup.stats() if dedup is not None else {}
+        status = "done"
+    finally:
+        state.status = status
+        checkpoint.finish_run(status, state.report, state.replan_stats)
+        # Traces of failed runs are kept too; they show where the run broke.
+        if trace is not None:
+            state.trace_file = export_trace(trace)
+    return state
+
+
+def resume_research(run_id, options=None, callbacks=None):
+    """Continue a checkpointed run from its last completed step; None if it is unknown."""
+    state, stored_options = load_research_state(run_id)
+    if state is None:
+        return None
+    return run_research(state.query, options or stored_options, callbacks, state=state)
+
+
+def _run_research(query, options, callbacks, state, checkpoint):
+    started = time.perf_counter()
+
+    # --- Plan ---
+    if not state.steps:
+        plan_started = time.perf_counter()
+        with span("plan", "plan"):
+            state.steps, state.deps = plan_research_dag(query, max_steps=options.max_steps)
+        state.timings["plan_seconds"] = time.perf_counter() - plan_started
+        checkpoint.save_plan(state.steps, state.deps)
+    steps, deps = state.steps, state.deps
+    _call(callbacks.on_plan, steps, deps)
+
+    # --- Execute and replan ---
+    context_store = state.context_store
+    replan_policy = ReplanPolicy(mode=options.replan_mode)
+
+    def run_step(idx):
+        step_ancestors = ancestors(deps, idx)
+        with span(steps[idx], "step", index=idx), dedup_step(idx, step_ancestors):
+            # Dependent steps only see their ancestors' results.
+            return execute_step(
+                steps[idx],
+                context_store.select(steps[idx], STEP_CONTEXT_TOKENS, step_ids=step_ancestors),
+            )
+
+    def on_step_complete(idx, result):
+        checkpoint.save_step(idx, steps[idx], result)
+        context_store.add(steps[idx], result, step_id=idx)
+        replan_policy.observe(idx, result)
+        _call(callbacks.on_step_complete, idx, steps[idx], result, len(state.completed), len(steps))
+        maybe_replan(wave_done=False)
+
+    def on_wave_complete(wave):
+        maybe_replan(wave_done=True)
+
+    def maybe_replan(wave_done):
+        if len(steps) > options.max_steps and not state.replan_limit_reached:
+            _call(
+                callbacks.on_warning,
+                f"Maximum total steps ({options.max_steps}) reached. No further replanning will be done, but all planned steps will be executed.",
+            )
+            state.replan_limit_reached = True
+
+        plan_exhausted = len(state.completed) == len(steps)
+        if not state.replan_limit_reached and replan_policy.should_replan(
+            wave_done=wave_done, plan_exhausted=plan_exhausted
+        ):
+            # Only the results since the last replan are sent.
+            delta = context_store.select(
+                query, REPLAN_CONTEXT_TOKENS, step_ids=set(replan_policy.pending_ids)
+            )
+            step_count = len(steps)
+            # replanner extends steps in place; new steps join the next wave.
+            with span("replan", "replan", after_steps=len(state.completed)):
+                _, state.replan_rounds, state.replan_limit_reached = replan_policy.timed_replan(
+                    delta,
+                    steps,
+                    state.replan_rounds,
+                    options.max_replan_rounds,
+                    state.replan_limit_reached,
+                    max_steps=options.max_steps,
+                    query=query,
+                )
+            checkpoint.save_replan(
+                state.replan_rounds, len(state.completed), steps[step_count:], state.replan_limit_reached
+            )
+            if len(steps) != step_count:
+                checkpoint.save_plan(steps, deps)
+                _call(callbacks.on_plan_updated, steps)
+
+    steps_started = time.perf_counter()
+    run_plan(
+        steps,
+        deps,
+        run_step,
+        completed=state.completed,
+        max_workers=options.max_parallel_steps,
+        on_wave_start=callbacks.on_steps_started,
+        on_step_complete=on_step_complete,
+        on_wave_complete=on_wave_complete,
+    )
+    state.timings["steps_seconds"] = time.perf_counter() - steps_started
+    state.replan_stats = replan_policy.summary()
+    logging.info(f"Replanning stats: {state.replan_stats}")
+
+    # --- Report ---
+    if not state.report:
+        report_started = time.perf_counter()
+        # Report writing queues behind interactive steps for LLM capacity.
+        with span("report", "report", mode=options.report_mode), priority_scope("report"):
+            if options.report_mode == "sectioned":
+                state.report = report_writer_sectioned(
+                    query, context_store, on_update=callbacks.on_report_update
+                )
+            else:
+                state.report = report_writer(context_store.select(query, REPORT_CONTEXT_TOKENS))
+        state.timings["report_seconds"] = time.perf_counter() - report_started
+        logging.info(
+            f"Context selection saved {context_store.savings()} tokens "
+            f"over {context_store.stats['calls']} calls"
+        )
+
+    # Time spent queued for LLM and search quota, summed over every call of the run.
+    state.timings["rate_limit_wait_seconds"] = current_span().attributes.get("rate_limit_wait_seconds", 0.0)
+    state.timings["total_seconds"] = time.perf_counter() - started
@@ -0,0 +1,175 @@
+import codecs
+import logging
+import os
+import re
+import threading
+from html.parser import HTMLParser
+
+from tracing import add_counts
+
+# Bytes read from one page before extraction stops. The crawler skips pages that
+# declare a larger Content-Length, since it cannot stop a browser render part way.
+EXTRACT_MAX_BYTES = int(os.getenv("EXTRACT_MAX_BYTES", str(512 * 1024)))
+# Characters of main content kept from one crawled page.
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", "8000"))
+CHUNK_BYTES = 16 * 1024
+
+# Elements that hold site chrome rather than page content. <header> and <form> are kept:
+# articles use <header> for their title and byline, and ASP.NET pages wrap everything in a <form>.
+BOILERPLATE_TAGS = ("nav", "footer", "aside", "script", "style", "noscript")
+
+LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+# Table rows and list items carry content even when they are only a word or two long.
+STRUCTURED_PATTERN = re.compile(r"^(?:\||[-*+] |\d+[.)] )")
+BOILERPLATE_PATTERN = re.compile(
+    r"cookie|subscribe|newsletter|sign (in|up)|log ?in|skip to|all rights reserved|privacy policy"
+    r"|terms of (use|service)|share (on|this)|follow us|©|copyright",
+    re.IGNORECASE,
+)
+
+
+class HeadParser(HTMLParser):
+    """Incremental parser that collects the title and meta description.
+
+    ``done`` turns true at ``</head>`` or ``<body>``, so callers can stop
+    reading the response there.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.description = None
+        self.done = False
+        self._in_title = False
+        self._title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            name = (attrs.get("name") or attrs.get("property") or "").lower()
+            if name in ("description", "og:description") and self.description is None:
+                self.description = (attrs.get("content") or "").strip() or None
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+            self.title = " ".join("".join(self._title_parts).split()) or None
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+
+
+class PageTooLarge(Exception):
+    """A page declares more than EXTRACT_MAX_BYTES, so it is not crawled."""
+
+
+async def declared_size(session, url, timeout=5):
+    """The Content-Length a HEAD request reports for ``url``, or None when unknown."""
+    try:
+        async with session.head(url, timeout=timeout, allow_redirects=True) as response:
+            if response.status != 200:
+                return None
+            return response.content_length
+    except Exception as e:
+        logging.debug(f"HEAD {url} failed: {e}")
+        return None
+
+
+async def read_head(response, max_bytes=EXTRACT_MAX_BYTES):
+    """Stream an aiohttp response into a HeadParser until the head is read or ``max_bytes``.
+
+    Returns (title, description, bytes downloaded).
+    """
+    parser = HeadParser()
+    decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+    downloaded = 0
+    async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+        downloaded += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or downloaded >= max_bytes:
+            break
+    return parser.title, parser.description, downloaded
+
+
+def strip_boilerplate(markdown, max_chars=EXTRACT_MAX_CHARS):
+    """Keep the main-content blocks of crawled markdown, up to ``max_chars``.
+
+    Drops link lists (menus, footers), short chrome such as cookie banners and
+    sign-in prompts, stray labels without numbers, and blocks repeated on the
+    page. Short table rows and list items are kept.
+    """
+    kept = []
+    size = 0
+    seen = set()
+    markdown = markdown.encode("utf-8")[:EXTRACT_MAX_BYTES].decode("utf-8", errors="ignore")
+    for block in re.split(r"\n\s*\n", markdown):
+        block = block.strip()
+        if not block or block in seen:
+            continue
+        seen.add(block)
+        heading = block.startswith("#")
+        text = LINK_PATTERN.sub(r"\1", block)
+        words = len(text.split())
+        link_chars = sum(len(m.group(1)) for m in LINK_PATTERN.finditer(block))
+        if not heading:
+            # Menus and link lists: most of the visible text sits inside links.
+            if link_chars > 0.6 * max(len(text.strip()), 1):
+                continue
+            if words < 12 and BOILERPLATE_PATTERN.search(text):
+                continue
+            if words < 4 and not STRUCTURED_PATTERN.match(text) and not any(c.isdigit() for c in text):
+                continue
+        if size + len(block) > max_chars:
+            kept.append(block[: max(max_chars - size, 0)])
+            break
+        kept.append(block)
+        size += len(block) + 2
+    # A trailing heading without its section is noise.
+    while kept and kept[-1].startswith("#"):
+        kept.pop()
+    return "\n\n".join(kept)
+
+
+class ExtractionStats:
+    """Process-wide bytes downloaded versus bytes kept by extraction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.bytes_downloaded = 0
+        self.bytes_kept = 0
+
+    def record(self, downloaded, kept):
+        with self._lock:
+            self.pages += 1
+            self.bytes_downloaded += downloaded
+            self.bytes_kept += kept
+
+    def stats(self):
+        with self._lock:
+            downloaded, kept, pages = self.bytes_downloaded, self.bytes_kept, self.pages
+        return {
+            "pages": pages,
+            "bytes_downloaded": downloaded,
+            "bytes_kept": kept,
+            "reduction": round(1 - kept / downloaded, 3) if downloaded else 0.0,
+            # About four bytes of text per LLM token.
+            "tokens_saved": (downloaded - kept) // 4,
+        }
+
+
+extraction_stats = ExtractionStats()
+
+
+def record_extraction(url, downloaded, kept):
+    """Count one extracted page globally and on the current step's trace spans."""
+    extraction_stats.record(downloaded, kept)
+    add_counts(bytes_downloaded=downloaded, bytes_kept=kept)
+    logging.info(f"Extracted {kept} of {downloaded} bytes from {url}")
@@ -0,0 +1,236 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connection pool sizing and timeouts shared by every provider.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_DNS_CACHE_SECONDS = int(os.getenv("HTTP_DNS_CACHE_SECONDS", "300"))
+
+
+class PoolStats:
+    """Requests, new connections and time spent waiting for a free connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def record(self, requests=0, connections=0, wait_seconds=None):
+        with self._lock:
+            self.requests += requests
+            self.connections += connections
+            if wait_seconds is not None:
+                self.waits += 1
+                self.wait_seconds += wait_seconds
+
+    def snapshot(self):
+        with self._lock:
+            requests, connections, waits, wait_seconds = self.requests, self.connections, self.waits, self.wait_seconds
+        return {
+            "requests": requests,
+            "new_connections": connections,
+            "reuse_rate": round(1 - connections / requests, 3) if requests else 0.0,
+            "wait_avg_ms": round(1000 * wait_seconds / waits, 2) if waits else 0.0,
+            "wait_total_seconds": round(wait_seconds, 3),
+        }
+
+
+# --- Synchronous Pool (requests) ---
+
+sync_stats = PoolStats()
+
+
+class _TimedPoolMixin:
+    """Counts connection checkouts, new connections and the wait for a free slot."""
+
+    def _get_conn(self, timeout=None):
+        started = time.perf_counter()
+        conn = super()._get_conn(timeout)
+        sync_stats.record(requests=1, wait_seconds=time.perf_counter() - started)
+        return conn
+
+    def _new_conn(self):
+        sync_stats.record(connections=1)
+        return super()._new_conn()
+
+
+class _TimedHTTPConnectionPool(_TimedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _TimedHTTPSConnectionPool(_TimedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with per-host limits, blocking until a connection is free."""
+
+    def __init__(self, per_host_limit=HTTP_PER_HOST_LIMIT, max_hosts=HTTP_MAX_CONNECTIONS):
+        super().__init__(pool_connections=max_hosts, pool_maxsize=per_host_limit, pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The process-wide requests Session; keep-alive connections are reused across calls."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = PooledAdapter()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def http_get(url, timeout=None, **kwargs):
+    """``GET`` through the shared session with the standard (connect, read) timeouts."""
+    return get_session().get(url, timeout=timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), **kwargs)
+
+
+# --- Asynchronous Pool (aiohttp) ---
+
+
+class AsyncHttpPool:
+    """One aiohttp session with a DNS-caching connector, shared by every event loop.
+
+    aiohttp sessions belong to one loop, while searches run on short-lived
+    loops of their own; the session lives on a background loop (like the
+    crawler pool) and callers hand it work through ``run``.
+    """
+
+    def __init__(self, max_connections=HTTP_MAX_CONNECTIONS, per_host_limit=HTTP_PER_HOST_LIMIT):
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.stats = PoolStats()
+        self.dns = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="http-pool", daemon=True)
+            self._thread.start()
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.stats.record(requests=1)
+
+        async def on_connection_create_start(session, context, params):
+            self.stats.record(connections=1)
+
+        async def on_queued_start(session, context, params):
+            context.queued_at = time.perf_counter()
+
+        async def on_queued_end(session, context, params):
+            self.stats.record(wait_seconds=time.perf_counter() - context.queued_at)
+
+        async def on_dns_hit(session, context, params):
+            self.dns["hits"] += 1
+
+        async def on_dns_miss(session, context, params):
+            self.dns["misses"] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_start.append(on_connection_create_start)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_dns_cache_hit.append(on_dns_hit)
+        trace.on_dns_cache_miss.append(on_dns_miss)
+        return trace
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.per_host_limit,
+                ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+                trace_configs=[self._trace_config()],
+            )
+        return self._session
+
+    async def _call(self, func):
+        return await func(await self._get_session())
+
+    async def run(self, func):
+        """Await ``func(session)`` on the pool's loop; awaitable from any event loop."""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._call(func), self._loop)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def shutdown(self, timeout=5):
+        with self._lock:
+            if self._thread is None:
+                return
+            if self._session is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout)
+                except Exception as e:
+                    logging.warning(f"Error closing HTTP pool session: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._loop.close()
+            self._thread = None
+            self._session = None
+
+    def snapshot(self):
+        return {**self.stats.snapshot(), "dns_cache_hits": self.dns["hits"], "dns_cache_misses": self.dns["misses"]}
+
+
+_async_pool = None
+_async_pool_lock = threading.Lock()
+
+
+def get_async_pool():
+    """The process-wide AsyncHttpPool, created on first use."""
+    global _async_pool
+    with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = AsyncHttpPool()
+            atexit.register(_async_pool.shutdown)
+        return _async_pool
+
+
+def http_stats():
+    """Pool statistics for the shared sync and async clients."""
+    return {"sync": sync_stats.snapshot(), "async": get_async_pool().snapshot()}
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from engine import ResearchCallbacks, ResearchOptions, ResearchState, load_research_state, run_research
+
+# Research runs executed at the same time in the background.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs kept for polling before the oldest are dropped.
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "50"))
+# How often the UI re-reads the state of a running job.
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+
+
+@dataclass
+class Job:
+    """A research run on the background executor; the UI polls its fields."""
+
+    id: str
+    query: str
+    options: ResearchOptions
+    state: ResearchState
+    status: str = "queued"  # queued, running, done, failed
+    running_steps: set = field(default_factory=set)
+    partial_report: Optional[str] = None
+    warnings: list = field(default_factory=list)
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def snapshot(self):
+        """(steps, completed step indices, running step indices) copied for rendering."""
+        return list(self.state.steps), set(self.state.completed.copy()), set(self.running_steps)
+
+
+class JobManager:
+    """Runs research in worker threads so Streamlit reruns never re-enter the loop.
+
+    One manager is shared by every session of the server process; a job keeps
+    running when the browser disconnects and can be looked up again by id.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, history=JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="research-job")
+        self._jobs = OrderedDict()
+        self._history = history
+        self._lock = threading.Lock()
+
+    def submit(self, query, options=None, state=None):
+        """Queue a run of ``query``; passing the ``state`` of a failed job resumes it.
+
+        The job id is the run id, so the run can be resumed from its
+        checkpoint after a restart.
+        """
+        if state is not None and state.status == "done":
+            raise ValueError(f"Run {state.run_id} has already finished")
+        state = state or ResearchState(query=query)
+        job = Job(id=state.run_id, query=query, options=options or ResearchOptions(), state=state)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        logging.info(f"Queued research job {job.id}: {query}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def resume(self, run_id):
+        """Requeue a checkpointed run this process does not know about; None if there is none.
+
+        Finished runs are never run again; they come back as a done job
+        holding the stored report.
+        """
+        job = self.get(run_id)
+        if job is not None:
+            return job
+        state, options = load_research_state(run_id)
+        if state is None:
+            return None
+        if state.status == "done":
+            job = Job(id=run_id, query=state.query, options=options, state=state, status="done")
+            job.finished_at = job.submitted_at
+            with self._lock:
+                self._jobs[job.id] = job
+                self._prune()
+            logging.info(f"Research job {run_id} already finished; not resubmitting")
+            return job
+        return self.submit(state.query, options, state=state)
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.active]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(finished) - self._history)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        callbacks = ResearchCallbacks(
+            on_steps_started=job.running_steps.update,
+            on_step_complete=lambda idx, *_: job.running_steps.discard(idx),
+            on_warning=job.warnings.append,
+            on_report_update=lambda report: setattr(job, "partial_report", report),
+        )
+        try:
+            run_research(job.query, job.options, callbacks, state=job.state)
+            job.status = "done"
+        except Exception as e:
+            logging.error(f"Research job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.running_steps.clear()
+            job.finished_at = time.time()
+            logging.info(f"Research job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
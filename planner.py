@@ -3,18 +3,58 @@ from web_agent import search_google
 from dotenv import load_dotenv
 from config import client
 import logging
+import os
+import re
+import time
+from ranking import char_ngrams, tfidf_matrix, tokenize
+from tracing import add_counts
 
 load_dotenv()
 
+STEP_PATTERN = re.compile(r"^\s*\d+\s*[.)]\s*(.+)$")
+DEPENDS_PATTERN = re.compile(r"\(\s*depends on:?\s*([^)]*)\)", re.IGNORECASE)
+# Proposed steps at least this similar (step_similarity) to a planned step are dropped.
+REPLAN_DUPLICATE_THRESHOLD = float(os.getenv("REPLAN_DUPLICATE_THRESHOLD", "0.6"))
 
-def plan_research(query, max_steps=20):
-    """Ask the LLM to generate a step-by-step research plan for the query, with a dynamic max_steps limit."""
+
+def parse_plan(plan_text):
+    """Parse a numbered plan into (steps, deps).
+
+    ``deps[i]`` lists the 0-based indices of earlier steps that step ``i``
+    needs, taken from a trailing "(depends on: 1, 3)" annotation. Steps
+    without an annotation depend on nothing.
+    """
+    steps = []
+    deps = []
+    for line in plan_text.split("\n"):
+        match = STEP_PATTERN.match(line)
+        if not match:
+            continue
+        text = match.group(1).strip()
+        step_deps = []
+        depends = DEPENDS_PATTERN.search(text)
+        if depends:
+            text = (text[: depends.start()] + text[depends.end() :]).strip()
+            step_deps = sorted(
+                {int(n) - 1 for n in re.findall(r"\d+", depends.group(1))
+                 if 0 < int(n) <= len(steps)}
+            )
+        steps.append(text)
+        deps.append(step_deps)
+    return steps, deps
+
+
+def plan_research_dag(query, max_steps=20):
+    """Ask the LLM for a research plan whose steps declare their dependencies; returns (steps, deps)."""
     plan_prompt = (
         "You are an expert research agent. "
         f"Given the following user query, create a clear, step-by-step research plan. "
         f"Each step should be actionable and focused on gathering or synthesizing information needed to answer the query. "
         f"Do not add unnecessary steps. Return the plan as a numbered list. "
-        f"Do not exceed {max_steps} steps in your plan.\n\n"
+        f"Do not exceed {max_steps} steps in your plan. "
+        "End every step with the numbers of the earlier steps whose results it needs, "
+        "written as '(depends on: 1, 2)', or '(depends on: none)' if it can be done independently. "
+        "Prefer independent fact-gathering steps so they can run in parallel.\n\n"
         f"User Query: {query}"
     )
     response = client.chat.completions.create(
@@ -25,20 +65,135 @@ def plan_research(query, max_steps=20):
         ],
     )
     plan_text = response.choices[0].message.content
-    steps = [
-        step[2:].strip()
-        for step in plan_text.split("\n")
-        if step.strip() and step[0].isdigit()
-    ]
+    return parse_plan(plan_text)
+
+
+def plan_research(query, max_steps=20):
+    """Ask the LLM to generate a step-by-step research plan for the query, with a dynamic max_steps limit."""
+    steps, _ = plan_research_dag(query, max_steps=max_steps)
     return steps
 
-def replanner(context, steps, replan_rounds, max_replan_rounds, replan_limit_reached, max_steps=20):
+# Generic plan steps on unrelated topics. Document frequencies for duplicate
+# detection come from here, so plan verbs ("investigate", "analyze") weigh
+# little and a pair's score does not depend on the size of the current plan.
+STEP_IDF_CORPUS = (
+    "Research the current state of the global electric vehicle market",
+    "Identify the key players and their market share",
+    "Analyze recent trends in consumer adoption",
+    "Investigate the regulatory environment and government policies",
+    "Examine the environmental impact of battery production",
+    "Gather data on historical sales figures over the past decade",
+    "Compare the costs and benefits of the main alternatives",
+    "Summarize expert opinions and forecasts for the next five years",
+    "Review academic studies on the effectiveness of the intervention",
+    "Identify the main challenges and limitations of the technology",
+    "Explore case studies of successful implementations",
+    "Evaluate the economic impact on local communities",
+    "Determine the major risks and how they are mitigated",
+    "Find statistics on usage and growth rates",
+    "Look up the latest news and announcements from major companies",
+    "Assess the financial performance of leading firms using annual reports",
+    "Investigate how the technology works and its underlying principles",
+    "Research the history and origins of the movement",
+    "Analyze public opinion and survey data",
+    "Examine the differences between the approaches in different countries",
+    "Identify gaps in the existing research literature",
+    "Collect information on pricing and cost trends",
+    "Study the supply chain and sourcing of raw materials",
+    "Review the security and privacy implications",
+    "Investigate the role of international organizations",
+    "Explore future developments and emerging innovations",
+    "Analyze the competitive landscape and barriers to entry",
+    "Research best practices recommended by industry experts",
+    "Examine the social and ethical considerations",
+    "Gather information on funding, investment and subsidies",
+    "Compare performance benchmarks of competing products versus the incumbent",
+    "Identify relevant laws, standards and compliance requirements",
+    "Summarize the findings and draw conclusions to answer the query",
+    "Synthesize the collected evidence into a final recommendation",
+    "Evaluate the long-term sustainability of the industry",
+    "Determine the effects on employment and the workforce",
+    "Investigate health outcomes reported in clinical trials",
+    "Research the infrastructure required to support adoption",
+    "Analyze the impact of recent policy changes over time",
+    "Examine how improvements in efficiency have affected costs",
+)
+# Verbs and fillers any step may use; every other word names what a step is about.
+PLAN_VOCABULARY = frozenset(
+    "research investigate analyze analyse examine identify explore review study determine assess evaluate "
+    "gather collect find look up search check summarize synthesize compare understand describe outline "
+    "discuss list provide information data details overview current recent latest main key major various "
+    "different specific relevant available existing overall also about more most versus vs between".split()
+)
+
+
+def _word_grams(word):
+    return set(char_ngrams(word, sizes=(3,)))
+
+
+def _unmatched_topic_terms(text, other):
+    """Terms of ``text`` outside PLAN_VOCABULARY with no similarly spelled term in ``other``."""
+    other_grams = [_word_grams(term) for term in set(tokenize(other))]
+    unmatched = []
+    for term in set(tokenize(text)) - PLAN_VOCABULARY:
+        grams = _word_grams(term)
+        if not any(len(grams & o) >= 0.5 * max(len(grams), len(o)) for o in other_grams):
+            unmatched.append(term)
+    return unmatched
+
+
+def step_similarity(texts):
+    """Pairwise similarity of plan steps: the mean of word and character n-gram TF-IDF cosines."""
+    similarity = 0
+    for analyzer in (tokenize, char_ngrams):
+        matrix = tfidf_matrix(texts, analyzer=analyzer, corpus=STEP_IDF_CORPUS)
+        similarity = similarity + 0.5 * (matrix @ matrix.T).toarray()
+    return similarity
+
+
+def prune_duplicate_steps(candidates, steps, threshold=REPLAN_DUPLICATE_THRESHOLD):
+    """Split ``candidates`` into (new steps, duplicates) against ``steps`` and each other.
+
+    Duplicates are (candidate, matched step, similarity) triples. A pair only
+    counts as a duplicate if every word of each, other than generic plan
+    vocabulary, has a similarly spelled counterpart in the other, so "solar
+    capacity" and "wind capacity" or "costs" and "benefits" stay apart however
+    close their scores.
+    """
+    if not candidates:
+        return [], []
+    texts = list(steps) + list(candidates)
+    similarity = step_similarity(texts)[len(steps) :]
+    kept, duplicates = [], []
+    # Each candidate is compared with the plan and the candidates kept before it.
+    allowed = list(range(len(steps)))
+    for i, candidate in enumerate(candidates):
+        matches = [
+            (similarity[i, j], j)
+            for j in allowed
+            if similarity[i, j] >= threshold
+            and not _unmatched_topic_terms(candidate, texts[j])
+            and not _unmatched_topic_terms(texts[j], candidate)
+        ]
+        if matches:
+            score, j = max(matches)
+            duplicates.append((candidate, texts[j], float(score)))
+        else:
+            kept.append(candidate)
+            allowed.append(len(steps) + i)
+    return kept, duplicates
+
+
+def replanner(context, steps, replan_rounds, max_replan_rounds, replan_limit_reached, max_steps=20, query=None):
     """Handles replanning logic and returns updated steps, replan_rounds, and replan_limit_reached, with a dynamic max_steps limit."""
     if replan_limit_reached:
         return steps, replan_rounds, replan_limit_reached
 
+    plan = "\n".join(f"{idx + 1}. {step}" for idx, step in enumerate(steps))
     replan_prompt = (
-        f"Given the completed steps and results so far:\n{context}\n\n"
+        (f"Original query: {query}\n\n" if query else "")
+        + f"Current research plan (completed and pending steps):\n{plan}\n\n"
+        f"Results of the steps completed since the last review:\n{context}\n\n"
         f"As an autonomous agent, do you need to add any new steps to fully answer the original query? "
         f"If yes, list them as a numbered list, but do not exceed a total of {max_steps} steps in the plan (including already completed and planned steps). "
         f"If not, reply 'No additional steps needed.'"
@@ -50,18 +205,20 @@ def replanner(context, steps, replan_rounds, max_replan_rounds, replan_limit_rea
             {"role": "user", "content": replan_prompt},
         ],
     )
-    replan_text = replan_response.choices[0].message.content.strip().lower()
-    if "no additional steps needed" in replan_text:
+    replan_text = replan_response.choices[0].message.content.strip()
+    if "no additional steps needed" in replan_text.lower():
         replan_rounds = 0  # Reset replan rounds if no new steps
         return steps, replan_rounds, replan_limit_reached
 
-    # Parse new steps, avoid duplicates, and enforce max_steps
-    new_steps = [
-        s[2:].strip() for s in replan_text.split("\n") if s.strip() and s[0].isdigit()
-    ]
+    # Parse new steps, drop repeats of planned or completed steps, then enforce max_steps
+    new_steps, _ = parse_plan(replan_text)
+    unique_steps, duplicates = prune_duplicate_steps(new_steps, steps)
+    for candidate, match, score in duplicates:
+        logging.info(f"Pruned duplicate step '{candidate}' (similarity {score:.2f} to '{match}')")
+    if duplicates:
+        add_counts(replan_duplicates_pruned=len(duplicates))
     # Only add steps if total does not exceed max_steps
-    allowed_new_steps = new_steps[: max(0, max_steps - len(steps))]
-    new_unique_steps = [new_step for new_step in allowed_new_steps if new_step not in steps]
+    new_unique_steps = unique_steps[: max(0, max_steps - len(steps))]
     if new_unique_steps:
         steps.extend(new_unique_steps)
         replan_rounds += 1
@@ -77,4 +234,82 @@ def replanner(context, steps, replan_rounds, max_replan_rounds, replan_limit_rea
                 "Maximum replanning rounds reached (no new unique steps). Will finish executing current plan and stop replanning."
             )
             replan_limit_reached = True
-    return steps, replan_rounds, replan_limit_reached
\ No newline at end of file
+    return steps, replan_rounds, replan_limit_reached
+
+
+# --- Replanning Policy ---
+
+# REPLAN_MODE decides when replanner is called:
+#   every_step - after every completed step (the old behaviour)
+#   every_n    - once REPLAN_EVERY_N steps have completed since the last replan
+#   wave       - at the end of each parallel wave
+#   novelty    - at the end of a wave whose results average enough unseen terms
+#                (REPLAN_NOVELTY_THRESHOLD)
+# Whatever the mode, a last replan runs when the plan is about to run out.
+REPLAN_MODE = os.getenv("REPLAN_MODE", "novelty")
+REPLAN_EVERY_N = int(os.getenv("REPLAN_EVERY_N", "3"))
+REPLAN_NOVELTY_THRESHOLD = float(os.getenv("REPLAN_NOVELTY_THRESHOLD", "0.35"))
+
+
+class ReplanPolicy:
+    """Decides when to replan and tracks the steps completed since the last replan."""
+
+    def __init__(self, mode=REPLAN_MODE, every_n=REPLAN_EVERY_N, novelty_threshold=REPLAN_NOVELTY_THRESHOLD):
+        self.mode = mode
+        self.every_n = every_n
+        self.novelty_threshold = novelty_threshold
+        self.pending_ids = []
+        self.novelties = []
+        self.seen_terms = set()
+        self.stats = {"steps": 0, "replans": 0, "replan_seconds": 0.0}
+
+    def observe(self, step_id, result):
+        """Record a completed step and update the novelty signal."""
+        terms = set(tokenize(result))
+        # The first result has nothing to be compared with, so it carries no novelty signal.
+        if terms and self.seen_terms:
+            self.novelties.append(len(terms - self.seen_terms) / len(terms))
+        self.seen_terms |= terms
+        self.pending_ids.append(step_id)
+        self.stats["steps"] += 1
+
+    def should_replan(self, wave_done=True, plan_exhausted=False):
+        """Whether to replan now; called after every step (``wave_done`` False) and at each wave's end."""
+        if not self.pending_ids:
+            return False
+        if plan_exhausted or self.mode == "every_step":
+            return True
+        if self.mode == "every_n":
+            return len(self.pending_ids) >= self.every_n
+        if not wave_done:
+            return False
+        if self.mode == "novelty":
+            return bool(self.novelties) and sum(self.novelties) / len(self.novelties) >= self.novelty_threshold
+        return True
+
+    def record_replan(self, seconds):
+        """Mark the pending steps as reviewed after a replan taking ``seconds``."""
+        self.pending_ids = []
+        self.novelties = []
+        self.stats["replans"] += 1
+        self.stats["replan_seconds"] += seconds
+
+    def timed_replan(self, *args, **kwargs):
+        """Call replanner, recording its latency; returns replanner's result."""
+        started = time.perf_counter()
+        try:
+            return replanner(*args, **kwargs)
+        finally:
+            self.record_replan(time.perf_counter() - started)
+
+    def summary(self):
+        """Replans skipped versus one replan per step (the old behaviour), and the latency that saved."""
+        replans = self.stats["replans"]
+        skipped = max(self.stats["steps"] - replans, 0)
+        avg_seconds = self.stats["replan_seconds"] / replans if replans else 0.0
+        return {
+            "replans": replans,
+            "skipped": skipped,
+            "avg_replan_seconds": round(avg_seconds, 2),
+            "estimated_seconds_saved": round(skipped * avg_seconds, 2),
+        }
@@ -0,0 +1,149 @@
+import re
+
+import numpy as np
+from scipy import sparse
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in into is it its of on or "
+    "that the their this to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text):
+    """Lower-case word tokens with stopwords removed."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def char_ngrams(text, sizes=(3, 4, 5)):
+    """Character n-grams of each word, padded with spaces; robust to inflection and word order."""
+    grams = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        padded = f" {word} "
+        for n in sizes:
+            grams.extend(padded[i : i + n] for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+
+def estimate_tokens(text):
+    """Rough LLM token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def chunk_text(text, max_words=120):
+    """Split text into passages of roughly ``max_words`` words along paragraph breaks."""
+    chunks = []
+    current = []
+    count = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        # Very long paragraphs are split on word boundaries.
+        for start in range(0, len(words), max_words):
+            piece = words[start : start + max_words]
+            if count and count + len(piece) > max_words:
+                chunks.append(" ".join(current))
+                current, count = [], 0
+            current.extend(piece)
+            count += len(piece)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of passages, stored as a sparse weight matrix.
+
+    Scoring a query is a column slice and a row sum, so ranking thousands of
+    passages takes well under a millisecond.
+    """
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = list(passages)
+        self.vocabulary = {}
+        rows, cols, counts = [], [], []
+        lengths = np.zeros(len(self.passages))
+        for row, passage in enumerate(self.passages):
+            tokens = tokenize(passage)
+            lengths[row] = len(tokens)
+            term_counts = {}
+            for token in tokens:
+                col = self.vocabulary.setdefault(token, len(self.vocabulary))
+                term_counts[col] = term_counts.get(col, 0) + 1
+            rows.extend([row] * len(term_counts))
+            cols.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+
+        shape = (len(self.passages), len(self.vocabulary))
+        tf = sparse.csr_matrix((np.array(counts, dtype=float), (rows, cols)), shape=shape)
+        n_docs = max(len(self.passages), 1)
+        doc_freq = np.bincount(np.array(cols, dtype=int), minlength=shape[1])
+        idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        norm = k1 * (1 - b + b * lengths / avg_length)
+
+        # BM25 weight for each non-zero (passage, term) entry.
+        tf = tf.tocoo()
+        weights = idf[tf.col] * tf.data * (k1 + 1) / (tf.data + norm[tf.row])
+        self.weights = sparse.csc_matrix((weights, (tf.row, tf.col)), shape=shape)
+
+    def scores(self, query):
+        cols = [self.vocabulary[t] for t in set(tokenize(query)) if t in self.vocabulary]
+        if not cols or not self.passages:
+            return np.zeros(len(self.passages))
+        return np.asarray(self.weights[:, cols].sum(axis=1)).ravel()
+
+    def top(self, query, k=None):
+        """Return passage indices ordered by descending score."""
+        order = np.argsort(-self.scores(query), kind="stable")
+        return order[:k].tolist() if k else order.tolist()
+
+
+def pack_passages(passages, order, token_budget):
+    """Take passages in ranked ``order`` until ``token_budget`` is used; return chosen indices."""
+    chosen = []
+    used = 0
+    for idx in order:
+        cost = estimate_tokens(passages[idx])
+        if used + cost > token_budget:
+            continue
+        chosen.append(idx)
+        used += cost
+    return chosen
+
+
+def tfidf_matrix(texts, analyzer=tokenize, corpus=None):
+    """L2-normalized TF-IDF rows for ``texts`` as a sparse CSR matrix.
+
+    Row dot products are cosine similarities. Document frequencies come from
+    ``corpus`` when given, so a pair's score does not depend on which other
+    texts are in the matrix; otherwise from ``texts`` themselves.
+    """
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for row, text in enumerate(texts):
+        term_counts = {}
+        for term in analyzer(text):
+            col = vocabulary.setdefault(term, len(vocabulary))
+            term_counts[col] = term_counts.get(col, 0) + 1
+        rows.extend([row] * len(term_counts))
+        cols.extend(term_counts.keys())
+        counts.extend(term_counts.values())
+    shape = (len(texts), len(vocabulary))
+    tf = sparse.csr_matrix((np.array(counts, dtype=float), (rows, cols)), shape=shape)
+    if corpus is None:
+        documents = len(texts)
+        doc_freq = np.bincount(np.array(cols, dtype=int), minlength=shape[1])
+    else:
+        documents = len(corpus)
+        doc_freq = np.zeros(shape[1])
+        for text in corpus:
+            for term in set(analyzer(text)):
+                if term in vocabulary:
+                    doc_freq[vocabulary[term]] += 1
+    idf = np.log((1 + documents) / (1 + doc_freq)) + 1
+    weighted = tf.multiply(idf).tocsr()
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1 / norms) @ weighted
@@ -0,0 +1,298 @@
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from cache import REDIS_URL
+from tracing import add_counts
+
+load_dotenv()
+
+# Azure OpenAI deployment quota; 0 disables a limit.
+AZURE_RPM = int(os.getenv("AZURE_RPM", "900"))
+AZURE_TPM = int(os.getenv("AZURE_TPM", "150000"))
+# Google Custom Search queries per day.
+GOOGLE_CSE_QPD = int(os.getenv("GOOGLE_CSE_QPD", "10000"))
+# "memory" limits this process only; "redis" shares the buckets across processes and hosts.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Longest a call queues for capacity before RateLimitExceeded is raised, in seconds.
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))
+
+# Lower numbers are admitted first when calls are queued.
+PRIORITIES = {"interactive": 0, "report": 1, "batch": 2}
+
+_priority = contextvars.ContextVar("rate_limit_priority", default="interactive")
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call would have to wait longer than its maximum wait."""
+
+
+@contextmanager
+def priority_scope(name):
+    """Run a block at priority ``name``, or at the current one if that is already lower."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown rate limit priority: {name}")
+    current = _priority.get()
+    token = _priority.set(max(name, current, key=PRIORITIES.get))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def default_limits():
+    """Limit name -> (capacity, refill per second) for every configured quota."""
+    limits = {
+        "azure:requests": (AZURE_RPM, AZURE_RPM / 60),
+        "azure:tokens": (AZURE_TPM, AZURE_TPM / 60),
+        "google:queries": (GOOGLE_CSE_QPD, GOOGLE_CSE_QPD / 86400),
+    }
+    return {name: limit for name, limit in limits.items() if limit[0] > 0}
+
+
+# --- Bucket Backends ---
+
+
+class LocalBuckets:
+    """Token buckets held in this process."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, requests, force=False):
+        """Take ``amount`` from every (key, amount, capacity, rate) bucket, all or nothing.
+
+        Returns 0 on success, otherwise the seconds until all of them could be
+        taken. ``force`` takes regardless and may leave a bucket in debt.
+        """
+        now = time.time()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, amount, capacity, rate in requests:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                levels.append(tokens)
+                if tokens < amount:
+                    wait = max(wait, (amount - tokens) / rate)
+            if wait and not force:
+                return wait
+            for (key, amount, _, _), tokens in zip(requests, levels):
+                self._buckets[key] = (tokens - amount, now)
+            return 0.0
+
+
+# Refill and take from every bucket atomically; times come from the Redis server clock.
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local force = ARGV[1] == '1'
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local amount = tonumber(ARGV[i * 3 - 1])
+  local capacity = tonumber(ARGV[i * 3])
+  local rate = tonumber(ARGV[i * 3 + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'updated')
+  local tokens = tonumber(state[1]) or capacity
+  local updated = tonumber(state[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+  levels[i] = tokens
+  if tokens < amount then
+    wait = math.max(wait, (amount - tokens) / rate)
+  end
+end
+if wait > 0 and not force then
+  return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 3])
+  local rate = tonumber(ARGV[i * 3 + 1])
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - tonumber(ARGV[i * 3 - 1])), 'updated', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return '0'
+"""
+
+
+class RedisBuckets:
+    """Token buckets in Redis, shared by every process using the same REDIS_URL.
+
+    If Redis becomes unreachable, calls fall back to local buckets rather
+    than failing.
+    """
+
+    name = "redis"
+
+    def __init__(self, url=REDIS_URL, prefix="deepquest:ratelimit:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.prefix = prefix
+        self._script = self.client.register_script(TAKE_SCRIPT)
+        self.fallback = LocalBuckets()
+
+    def take(self, requests, force=False):
+        args = ["1" if force else "0"]
+        for _, amount, capacity, rate in requests:
+            args += [amount, capacity, rate]
+        try:
+            return float(self._script(keys=[self.prefix + key for key, *_ in requests], args=args))
+        except Exception as e:
+            logging.warning(f"Redis rate limiter unavailable, using local buckets: {e}")
+            return self.fallback.take(requests, force)
+
+
+def make_buckets(name=RATE_LIMIT_BACKEND):
+    if name == "redis":
+        try:
+            buckets = RedisBuckets()
+            buckets.client.ping()
+            return buckets
+        except Exception as e:
+            logging.warning(f"Redis rate limiter unavailable, limiting this process only: {e}")
+    return LocalBuckets()
+
+
+# --- Limiter ---
+
+
+class RateLimiter:
+    """Admits calls against token buckets, queueing waiters by priority.
+
+    A waiter only takes from the buckets once no waiter ahead of it (by
+    priority, then arrival) needs any of the same limits, so a queued
+    interactive call is admitted before any batch or report call that
+    arrived earlier, while calls on unrelated limits (Azure and Google) never
+    wait on each other. The queue order is kept per process; with the Redis
+    backend the buckets themselves are shared.
+    """
+
+    def __init__(self, buckets=None, limits=None):
+        self.buckets = buckets or LocalBuckets()
+        self.limits = default_limits() if limits is None else limits
+        self._queue = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+        self.waits = {name: deque(maxlen=1000) for name in PRIORITIES}
+        self.counters = {name: {"calls": 0, "queued": 0, "rejected": 0} for name in PRIORITIES}
+
+    def _requests(self, costs):
+        requests = []
+        for name, amount in costs.items():
+            if name in self.limits and amount > 0:
+                capacity, rate = self.limits[name]
+                # A single call larger than the bucket would never fit; it waits for a full bucket instead.
+                requests.append((name, min(amount, capacity), capacity, rate))
+        return requests
+
+    def acquire(self, costs, priority=None, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Block until every limit in ``costs`` ({limit name: amount}) has capacity.
+
+        Returns the seconds spent queued. Raises RateLimitExceeded if the
+        call would wait longer than ``max_wait``.
+        """
+        requests = self._requests(costs)
+        priority = priority or current_priority()
+        if not requests:
+            return 0.0
+        started = time.monotonic()
+        deadline = started + max_wait
+        names = frozenset(name for name, *_ in requests)
+        ticket = (PRIORITIES[priority], next(self._tickets), names)
+        with self._cond:
+            self._queue.append(ticket)
+            self._cond.notify_all()
+        try:
+            while True:
+                with self._cond:
+                    while any(other < ticket and other[2] & names for other in self._queue):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(priority, names, max_wait)
+                        # A departing waiter ahead of us wakes the queue early.
+                        self._cond.wait(remaining)
+                # The lock is process-wide, so a Redis round trip must not hold it.
+                wait = self.buckets.take(requests)
+                if not wait:
+                    break
+                if wait > deadline - time.monotonic():
+                    self._reject(priority, names, max_wait)
+                with self._cond:
+                    # A higher-priority arrival or a departing waiter wakes the queue early.
+                    self._cond.wait(wait)
+        finally:
+            with self._cond:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+        waited = time.monotonic() - started
+        self._record(priority, waited)
+        return waited
+
+    def adjust(self, name, amount):
+        """Charge (or refund, if negative) ``amount`` once a call's real cost is known."""
+        if name in self.limits and amount:
+            capacity, rate = self.limits[name]
+            self.buckets.take([(name, amount, capacity, rate)], force=True)
+
+    def _reject(self, priority, names, max_wait):
+        self._count(priority, "rejected")
+        raise RateLimitExceeded(f"Rate limit for {', '.join(sorted(names))} needs more than {max_wait:g}s of waiting")
+
+    def _count(self, priority, name):
+        with self._cond:
+            self.counters[priority][name] += 1
+
+    def _record(self, priority, waited):
+        with self._cond:
+            self.counters[priority]["calls"] += 1
+            self.waits[priority].append(waited)
+            if waited >= 0.01:
+                self.counters[priority]["queued"] += 1
+        if waited >= 0.01:
+            add_counts(rate_limit_wait_seconds=waited)
+
+    def stats(self):
+        """Queue wait per priority (calls, queued, rejected, mean/p95/max seconds)."""
+        with self._cond:
+            report = {"backend": self.buckets.name, "waiting": len(self._queue)}
+            for name in PRIORITIES:
+                waits = sorted(self.waits[name])
+                report[name] = {
+                    **self.counters[name],
+                    "mean_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                    "p95_wait_seconds": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+                    "max_wait_seconds": round(waits[-1], 3) if waits else 0.0,
+                }
+            return report
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide RateLimiter, created on first use."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(make_buckets())
+        return _limiter
+
+
+def ratelimit_stats():
+    return get_rate_limiter().stats()
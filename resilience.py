@@ -0,0 +1,357 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import requests
+
+from ratelimit import RateLimitExceeded
+
+# Attempts per call (first try included) and the backoff between them, in seconds.
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+# Consecutive failed attempts that open a provider's breaker, and how long it stays open.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+# Closed breakers unused for this long are dropped; the crawler makes one per host.
+BREAKER_IDLE_SECONDS = float(os.getenv("BREAKER_IDLE_SECONDS", "600"))
+# Providers whose calls are duplicated when the first attempt is slower than usual.
+# Search providers run in threads, which cannot be cancelled: the losing call still
+# completes, so a hedge doubles that call's cost (Google quota, an executor slot).
+HEDGED_PROVIDERS = {p for p in os.getenv("HEDGED_PROVIDERS", "").split(",") if p}
+# Hedge after this long when a provider has no latency history yet.
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "2.0"))
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+RETRYABLE_NEWSAPI_CODES = {"rateLimited", "unexpectedError"}
+# Rejected credentials fail every later call too, so they count toward opening the breaker.
+AUTH_FAILURE_STATUS = {401, 403}
+# Errors in our own handling of a response; retrying cannot help.
+FATAL_ERRORS = (ValueError, TypeError, KeyError, AttributeError, IndexError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+
+class ProviderError(Exception):
+    """A provider call that returned a failure instead of raising; ``status`` is its HTTP status if known."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# --- Error Classification ---
+
+
+def _retry_after(headers):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(error):
+    """Return (retryable, retry_after seconds or None) for an exception from a provider call."""
+    if isinstance(error, (CircuitOpenError, RateLimitExceeded)):
+        return False, None
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status in RETRYABLE_STATUS, _retry_after(error.response.headers)
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUS, _retry_after(error.headers)
+    if isinstance(error, ProviderError) and error.status:
+        return error.status in RETRYABLE_STATUS, None
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, aiohttp.ClientConnectionError)):
+        return True, None
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True, None
+    if type(error).__name__ == "NewsAPIException":
+        return error.get_code() in RETRYABLE_NEWSAPI_CODES, None
+    if isinstance(error, FATAL_ERRORS):
+        return False, None
+    # Unknown errors (browser crashes, protocol errors) are usually transient.
+    return True, None
+
+
+def _status(error):
+    """The HTTP status of a provider error, or None."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code
+    if isinstance(error, (aiohttp.ClientResponseError, ProviderError)):
+        return error.status
+    return None
+
+
+def raise_for_retryable_status(response):
+    """Raise HTTPError for rate limits and server errors; other statuses are left to the caller."""
+    if response.status_code in RETRYABLE_STATUS:
+        response.raise_for_status()
+    return response
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
+
+
+# --- Circuit Breakers and Metrics ---
+
+
+class CircuitBreaker:
+    """Per-provider breaker: closed, open (calls rejected) or half-open (one trial call)."""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_used = time.monotonic()
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "fatal": 0,
+            "rejected": 0,
+            "opened": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+        self.latencies = deque(maxlen=200)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def allow(self):
+        """True if a call may go ahead; moves an expired open breaker to half-open."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def is_open(self):
+        """True while calls are being rejected, without claiming the half-open trial."""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_seconds
+
+    def record_success(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+            if self.state != "closed":
+                logging.info(f"Circuit for {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.counters["failures"] += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_running = False
+                self.counters["opened"] += 1
+                logging.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+
+    def hedge_delay(self):
+        """The 90th-percentile latency seen so far, or HEDGE_DELAY_SECONDS without history."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < 10:
+            return HEDGE_DELAY_SECONDS
+        return latencies[int(len(latencies) * 0.9)]
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, **self.counters}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    now = time.monotonic()
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            # Pruned only when a breaker is added, so the registry cannot grow with idle hosts.
+            for name, other in list(_breakers.items()):
+                if other.state == "closed" and now - other.last_used > BREAKER_IDLE_SECONDS:
+                    del _breakers[name]
+            breaker = _breakers[provider] = CircuitBreaker(provider)
+        breaker.last_used = now
+        return breaker
+
+
+def resilience_stats(unhealthy_only=False):
+    """Breaker state and retry counters per provider; only open and half-open ones if ``unhealthy_only``."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    stats = {breaker.name: breaker.stats() for breaker in breakers}
+    if unhealthy_only:
+        stats = {name: s for name, s in stats.items() if s["state"] != "closed"}
+    return stats
+
+
+# --- Retrying Calls ---
+
+
+def _record_fatal(breaker, started, error):
+    if isinstance(error, RateLimitExceeded):
+        # Refused by our own quota before the provider was reached.
+        breaker.count("rejected")
+        return
+    breaker.count("fatal")
+    if _status(error) in AUTH_FAILURE_STATUS:
+        breaker.record_failure()
+        return
+    # The provider answered, so it is up; a request it rejects does not count against it.
+    breaker.record_success(time.perf_counter() - started)
+
+
+def call_with_retry(provider, func, *args, max_attempts=RETRY_MAX_ATTEMPTS, **kwargs):
+    """Call ``func`` under ``provider``'s breaker, retrying retryable errors with backoff."""
+    breaker = get_breaker(provider)
+    breaker.count("calls")
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{provider} circuit open")
+        breaker.count("attempts")
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            retryable, retry_after = classify(e)
+            if not retryable:
+                _record_fatal(breaker, started, e)
+                logging.error(f"{provider} call {func.__name__} failed (not retryable): {e}")
+                raise
+            breaker.record_failure()
+            if attempt + 1 >= max_attempts:
+                logging.error(f"All {max_attempts} attempts failed for {provider} call {func.__name__}: {e}")
+                raise
+            delay = backoff_delay(attempt, retry_after)
+            logging.warning(f"Attempt {attempt + 1} failed for {provider} call {func.__name__}: {e}; retrying in {delay:.2f}s")
+            breaker.count("retries")
+            time.sleep(delay)
+        else:
+            breaker.record_success(time.perf_counter() - started)
+            return result
+
+
+async def async_call_with_retry(provider, func, *args, max_attempts=RETRY_MAX_ATTEMPTS, **kwargs):
+    """``call_with_retry`` for coroutine functions; backoff sleeps do not block the loop."""
+    breaker = get_breaker(provider)
+    breaker.count("calls")
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{provider} circuit open")
+        breaker.count("attempts")
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retryable, retry_after = classify(e)
+            if not retryable:
+                _record_fatal(breaker, started, e)
+                logging.error(f"{provider} call {func.__name__} failed (not retryable): {e}")
+                raise
+            breaker.record_failure()
+            if attempt + 1 >= max_attempts:
+                logging.error(f"All {max_attempts} attempts failed for {provider} call {func.__name__}: {e}")
+                raise
+            delay = backoff_delay(attempt, retry_after)
+            logging.warning(f"Attempt {attempt + 1} failed for {provider} call {func.__name__}: {e}; retrying in {delay:.2f}s")
+            breaker.count("retries")
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success(time.perf_counter() - started)
+            return result
+
+
+def resilient(provider, max_attempts=RETRY_MAX_ATTEMPTS):
+    """Decorator form of ``call_with_retry``."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return call_with_retry(provider, func, *args, max_attempts=max_attempts, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def hedged(provider, start):
+    """Await ``start()``; if it is slower than usual, race a second ``start()`` against it.
+
+    Only providers listed in HEDGED_PROVIDERS are hedged. The first successful
+    result wins and the loser is cancelled. Cancelling a future from
+    ``run_in_executor`` does not stop its thread, so for such calls a hedge
+    costs two full requests; the ``hedges`` counter is the number of extra
+    requests made.
+    """
+    if provider not in HEDGED_PROVIDERS:
+        return await start()
+    breaker = get_breaker(provider)
+    tasks = [asyncio.ensure_future(start())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=breaker.hedge_delay())
+        if done:
+            return tasks[0].result()
+        breaker.count("hedges")
+        tasks.append(asyncio.ensure_future(start()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    error = error or asyncio.CancelledError()
+                elif task.exception() is None:
+                    if task is tasks[1]:
+                        breaker.count("hedge_wins")
+                    return task.result()
+                else:
+                    error = task.exception()
+        raise error
+    finally:
+        # Also reached when the caller cancels us, e.g. from asyncio.wait_for.
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,80 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tracing import submit
+
+# Maximum number of research steps executed at the same time.
+MAX_PARALLEL_STEPS = int(os.getenv("MAX_PARALLEL_STEPS", "4"))
+
+
+def step_dependencies(deps, idx):
+    """Direct dependencies of step ``idx``.
+
+    Steps without an entry in ``deps`` (for example steps added by the
+    replanner) depend on every step before them.
+    """
+    if idx < len(deps) and deps[idx] is not None:
+        return deps[idx]
+    return list(range(idx))
+
+
+def ancestors(deps, idx):
+    """All steps that step ``idx`` transitively depends on."""
+    seen = set()
+    stack = list(step_dependencies(deps, idx))
+    while stack:
+        parent = stack.pop()
+        if parent not in seen:
+            seen.add(parent)
+            stack.extend(step_dependencies(deps, parent))
+    return seen
+
+
+def ready_steps(steps, deps, completed):
+    """Pending steps whose dependencies have all completed."""
+    return [
+        idx
+        for idx in range(len(steps))
+        if idx not in completed
+        and all(parent in completed for parent in step_dependencies(deps, idx))
+    ]
+
+
+def run_plan(
+    steps,
+    deps,
+    execute,
+    completed=None,
+    max_workers=MAX_PARALLEL_STEPS,
+    on_wave_start=None,
+    on_step_complete=None,
+    on_wave_complete=None,
+):
+    """Execute a step DAG in waves of independent steps.
+
+    Each wave runs every step whose dependencies are satisfied, up to
+    ``max_workers`` at a time. ``execute(idx)`` runs in a worker thread and
+    returns the step result; the callbacks run on the calling thread, so they
+    may update the UI. ``on_wave_complete(wave)`` may extend ``steps`` and
+    ``deps`` (for example after replanning); new steps join later waves.
+    Returns ``completed``, a dict of step index to result.
+    """
+    completed = {} if completed is None else completed
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="research-step") as pool:
+        while len(completed) < len(steps):
+            wave = ready_steps(steps, deps, completed)
+            if not wave:
+                # Unsatisfiable dependencies; fall back to plan order.
+                wave = [min(idx for idx in range(len(steps)) if idx not in completed)]
+                logging.warning(f"No runnable steps; forcing step {wave[0] + 1}")
+            if on_wave_start:
+                on_wave_start(wave)
+            futures = {submit(pool, execute, idx): idx for idx in wave}
+            for future in as_completed(futures):
+                idx = futures[future]
+                completed[idx] = future.result()
+                if on_step_complete:
+                    on_step_complete(idx, completed[idx])
+            if on_wave_complete:
+                on_wave_complete(wave)
+    return completed
@@ -0,0 +1,212 @@
+import contextvars
+import logging
+import os
+import random
+import re
+import threading
+from contextlib import contextmanager
+
+from cache import make_backend, normalize_url
+from ranking import tokenize
+from tracing import add_counts
+
+SOURCE_SELECTION_ENABLED = os.getenv("SOURCE_SELECTION_ENABLED", "true").lower() == "true"
+# Where citation feedback is kept across runs: "disk", "redis" or "memory".
+SOURCE_STATS_BACKEND = os.getenv("SOURCE_STATS_BACKEND", "disk")
+# A provider is called when its sampled citation rate reaches this value.
+SOURCE_SELECT_THRESHOLD = float(os.getenv("SOURCE_SELECT_THRESHOLD", "0.3"))
+# How many runs' worth of evidence the keyword classifier's prior is worth.
+SOURCE_PRIOR_WEIGHT = float(os.getenv("SOURCE_PRIOR_WEIGHT", "4"))
+
+# Cheap classifier: words that suggest a provider has something citable for a step.
+PROVIDER_KEYWORDS = {
+    "ArXiv": set(
+        "research paper papers study studies preprint arxiv algorithm algorithms model models neural network "
+        "networks learning deep machine quantum physics theory theorem proof method methods benchmark dataset "
+        "experiment experiments scientific science mathematical optimization transformer llm".split()
+    ),
+    "NewsAPI": set(
+        "news latest recent recently today week month announced announcement launch launched breaking "
+        "current trend trends market markets election policy regulation deal merger acquisition lawsuit".split()
+    ),
+    "SEC": set(
+        "sec filing filings annual quarterly revenue revenues earnings profit shareholders shareholder "
+        "stock ticker ipo edgar 10k 10q 8k financial financials balance sheet company companies corporation".split()
+    ),
+    "Wikipedia": set(
+        "history historical background overview definition define concept biography origin origins "
+        "introduction explain explained meaning timeline founded who".split()
+    ),
+}
+PROVIDER_PATTERNS = {
+    "NewsAPI": re.compile(r"\b20[2-9]\d\b"),
+    "SEC": re.compile(r"\b(?:10-K|10-Q|8-K|S-1|Inc\.|Corp\.|NYSE|NASDAQ)(?:\W|$)"),
+}
+# Prior citation rate of a provider whose keywords did or did not match the step.
+PRIOR_RATES = {"match": 0.75, "none": 0.2}
+
+URL_PATTERN = re.compile(r"https?://[^\s)\]>\"']+")
+
+_current_ledger = contextvars.ContextVar("source_ledger", default=None)
+
+
+def classify_step(text, providers=PROVIDER_KEYWORDS):
+    """Context of each provider for a step: "match" if the step mentions its keywords, else "none"."""
+    tokens = set(tokenize(text))
+    contexts = {}
+    for provider in providers:
+        pattern = PROVIDER_PATTERNS.get(provider)
+        matched = tokens & PROVIDER_KEYWORDS.get(provider, set()) or (pattern is not None and pattern.search(text))
+        contexts[provider] = "match" if matched else "none"
+    return contexts
+
+
+class SourceSelector:
+    """Thompson-sampling bandit choosing which secondary providers to call for a step.
+
+    Each (provider, context) arm has a Beta posterior over the chance that the
+    provider's results get cited in the final report. The keyword classifier
+    sets the prior; cited and uncited calls from finished runs update it.
+    """
+
+    def __init__(self, backend=None, threshold=SOURCE_SELECT_THRESHOLD, prior_weight=SOURCE_PRIOR_WEIGHT):
+        self.backend = backend
+        self.threshold = threshold
+        self.prior_weight = prior_weight
+        self._lock = threading.Lock()
+        self.counts = self._load()
+        self.counters = {"selected": 0, "skipped": 0, "cited": 0, "uncited": 0}
+
+    def _load(self):
+        if self.backend is None:
+            return {}
+        try:
+            return self.backend.get("counts") or {}
+        except Exception as e:
+            logging.warning(f"Source selector stats unavailable: {e}")
+            return {}
+
+    def posterior(self, provider, context):
+        """(alpha, beta) of the provider's citation rate in ``context``."""
+        rate = PRIOR_RATES[context]
+        cited, uncited = self.counts.get(provider, {}).get(context, (0, 0))
+        return self.prior_weight * rate + cited, self.prior_weight * (1 - rate) + uncited
+
+    def select(self, text, providers):
+        """Return {provider: context} for the providers worth calling for ``text``."""
+        contexts = classify_step(text, providers)
+        chosen = {}
+        with self._lock:
+            for provider, context in contexts.items():
+                if random.betavariate(*self.posterior(provider, context)) >= self.threshold:
+                    chosen[provider] = context
+            self.counters["selected"] += len(chosen)
+            self.counters["skipped"] += len(contexts) - len(chosen)
+        return chosen
+
+    def learn(self, calls, report):
+        """Update the arms from ``calls`` ((provider, context, urls) triples) and the final report."""
+        cited_urls = {normalize_url(url) for url in URL_PATTERN.findall(report or "")}
+        deltas = {}
+        for provider, context, urls in calls:
+            cited = any(normalize_url(url) in cited_urls for url in urls)
+            arm = deltas.setdefault(provider, {}).setdefault(context, [0, 0])
+            arm[0 if cited else 1] += 1
+        if not deltas:
+            return
+        with self._lock:
+            # Other processes may have learned since we loaded; merge into the latest counts.
+            self.counts = self._load() or self.counts
+            for provider, arms in deltas.items():
+                for context, (cited, uncited) in arms.items():
+                    arm = self.counts.setdefault(provider, {}).setdefault(context, [0, 0])
+                    arm[0] += cited
+                    arm[1] += uncited
+                    self.counters["cited"] += cited
+                    self.counters["uncited"] += uncited
+            if self.backend is not None:
+                try:
+                    self.backend.set("counts", self.counts)
+                except Exception as e:
+                    logging.warning(f"Saving source selector stats failed: {e}")
+        logging.info(f"Source selection feedback: {deltas}")
+
+    def stats(self):
+        with self._lock:
+            rates = {
+                provider: {
+                    context: round(alpha / (alpha + beta), 3)
+                    for context in PRIOR_RATES
+                    for alpha, beta in [self.posterior(provider, context)]
+                }
+                for provider in PROVIDER_KEYWORDS
+            }
+            return {**self.counters, "citation_rates": rates}
+
+
+_selector = None
+_selector_lock = threading.Lock()
+
+
+def get_source_selector():
+    """The process-wide SourceSelector, created on first use."""
+    global _selector
+    with _selector_lock:
+        if _selector is None:
+            _selector = SourceSelector(make_backend(SOURCE_STATS_BACKEND, prefix="sources:"))
+        return _selector
+
+
+class SourceLedger:
+    """The secondary-provider calls of one run and the URLs each returned."""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, provider, context, results, sent=None):
+        """Note one provider call whose results were passed on as ``sent`` (all of them if None).
+
+        Calls that only returned errors, or whose every URL was cut before the
+        LLM saw it, carry no signal and are dropped.
+        """
+        if results and all("Error" in result.partition("\n")[0] for result in results):
+            return
+        urls = URL_PATTERN.findall("\n".join(results))
+        if sent is not None and urls:
+            urls = [url for url in urls if url in sent]
+            if not urls:
+                return
+        with self._lock:
+            self.calls.append((provider, context, urls))
+
+
+@contextmanager
+def source_scope(enabled=SOURCE_SELECTION_ENABLED):
+    """Select providers per step within the block; yields the run's SourceLedger (or None when disabled)."""
+    if not enabled:
+        yield None
+        return
+    ledger = SourceLedger()
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def select_providers(text, providers):
+    """{provider: context} to call for ``text``; every provider (context None) outside a source_scope."""
+    if _current_ledger.get() is None:
+        return {provider: None for provider in providers}
+    chosen = get_source_selector().select(text, providers)
+    skipped = len(providers) - len(chosen)
+    if skipped:
+        add_counts(providers_skipped=skipped)
+    return chosen
+
+
+def record_provider_results(provider, context, results, sent=None):
+    ledger = _current_ledger.get()
+    if ledger is not None and context is not None:
+        ledger.record(provider, context, results, sent)
@@ -0,0 +1,315 @@
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from cache import REDIS_URL
+from ranking import tokenize
+from source_selector import classify_step
+
+# "sqlite" keeps the policy in POLICY_DB; "redis" shares it through REDIS_URL (SQLite if unreachable).
+POLICY_BACKEND = os.getenv("POLICY_BACKEND", "sqlite")
+POLICY_DB = os.getenv("POLICY_DB", os.path.join(".cache", "policy.sqlite3"))
+# Width of the LinUCB confidence bonus; higher explores more. Rewards are +-1, so with
+# the bonus of an untried arm near alpha * |x| (about 1.5 * alpha), alpha must stay well
+# below 1 for an arm with consistently good feedback to keep winning.
+POLICY_ALPHA = float(os.getenv("POLICY_ALPHA", "0.25"))
+# How often buffered feedback is written and other processes' feedback is read, in seconds.
+POLICY_FLUSH_SECONDS = float(os.getenv("POLICY_FLUSH_SECONDS", "5"))
+
+STEP_CHOICES = (5, 10, 15, 20)
+REPLAN_CHOICES = (0, 1, 2, 3)
+ARMS = [(steps, replans) for steps in STEP_CHOICES for replans in REPLAN_CHOICES]
+# Before any feedback the policy prefers ResearchOptions' defaults, by this much reward;
+# a single thumbs-down is enough to move it elsewhere.
+PRIOR_ARM = (20, 3)
+PRIOR_REWARD = 0.2
+
+QUESTION_WORDS = {"how", "why", "what", "which", "who", "when", "where", "should", "can", "does", "is"}
+COMPARISON_WORDS = {"compare", "comparison", "versus", "vs", "difference", "differences", "tradeoffs", "pros", "cons"}
+BREADTH_WORDS = {"overview", "landscape", "survey", "comprehensive", "history", "trends", "state", "future", "impact"}
+TEMPORAL_PATTERN = re.compile(r"\b(?:20[2-9]\d|latest|recent|current|today|this year)\b", re.I)
+PROVIDER_CONTEXTS = ("ArXiv", "NewsAPI", "SEC", "Wikipedia")
+
+
+def query_features(query):
+    """Feature vector of a research query for the step policy."""
+    words = query.split()
+    lowered = {w.strip("?,.;:").lower() for w in words}
+    contexts = classify_step(query)
+    capitalized = sum(1 for w in words[1:] if w[:1].isupper())
+    return np.array(
+        [
+            1.0,
+            min(len(words), 60) / 60,
+            min(len(tokenize(query)), 30) / 30,
+            1.0 if "?" in query or (words and words[0].lower() in QUESTION_WORDS) else 0.0,
+            1.0 if lowered & COMPARISON_WORDS else 0.0,
+            1.0 if lowered & BREADTH_WORDS else 0.0,
+            1.0 if TEMPORAL_PATTERN.search(query) else 0.0,
+            min(capitalized, 6) / 6,
+            min(query.count(",") + sum(1 for w in words if w.lower() in ("and", "or")), 5) / 5,
+            *(1.0 if contexts[p] == "match" else 0.0 for p in PROVIDER_CONTEXTS),
+        ]
+    )
+
+
+FEATURE_DIM = len(query_features("x"))
+
+
+# --- Storage Backends ---
+
+
+def _arm_key(arm):
+    return f"{arm[0]}|{arm[1]}"
+
+
+class SQLitePolicyStore:
+    """Per-arm sufficient statistics (sum of x xT, sum of reward x, pulls) in SQLite.
+
+    Adds run in one IMMEDIATE transaction, so feedback from several processes
+    is summed rather than overwritten.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=POLICY_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS policy_arms ("
+                "arm TEXT PRIMARY KEY, dim INTEGER NOT NULL, a BLOB NOT NULL, b BLOB NOT NULL, pulls INTEGER NOT NULL)"
+            )
+
+    def load(self, arms, dim):
+        """Stored (A sums, b sums, pulls) for ``arms``; arms stored with another feature size read as empty."""
+        a, b, pulls = np.zeros((len(arms), dim, dim)), np.zeros((len(arms), dim)), np.zeros(len(arms))
+        with self._lock:
+            rows = self._conn.execute("SELECT arm, dim, a, b, pulls FROM policy_arms").fetchall()
+        index = {_arm_key(arm): i for i, arm in enumerate(arms)}
+        for arm, stored_dim, a_blob, b_blob, arm_pulls in rows:
+            if arm in index and stored_dim == dim:
+                i = index[arm]
+                a[i] = np.frombuffer(a_blob).reshape(dim, dim)
+                b[i] = np.frombuffer(b_blob)
+                pulls[i] = arm_pulls
+        return a, b, pulls
+
+    def add(self, arms, a, b, pulls):
+        dim = a.shape[-1]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for i in np.flatnonzero(pulls):
+                    key = _arm_key(arms[i])
+                    row = self._conn.execute(
+                        "SELECT a, b, pulls FROM policy_arms WHERE arm = ? AND dim = ?", (key, dim)
+                    ).fetchone()
+                    arm_a, arm_b, arm_pulls = a[i], b[i], int(pulls[i])
+                    if row is not None:
+                        arm_a = arm_a + np.frombuffer(row[0]).reshape(dim, dim)
+                        arm_b = arm_b + np.frombuffer(row[1])
+                        arm_pulls += row[2]
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO policy_arms (arm, dim, a, b, pulls) VALUES (?, ?, ?, ?, ?)",
+                        (key, dim, arm_a.tobytes(), arm_b.tobytes(), arm_pulls),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class RedisPolicyStore:
+    """The same statistics as Redis hashes, added element-wise with HINCRBYFLOAT in one transaction."""
+
+    name = "redis"
+
+    def __init__(self, url=REDIS_URL, prefix="deepquest:policy:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.prefix = prefix
+
+    def load(self, arms, dim):
+        a, b, pulls = np.zeros((len(arms), dim, dim)), np.zeros((len(arms), dim)), np.zeros(len(arms))
+        pipe = self.client.pipeline(transaction=False)
+        for arm in arms:
+            pipe.hgetall(self.prefix + _arm_key(arm))
+        for i, fields in enumerate(pipe.execute()):
+            if not fields or int(float(fields.get(b"dim", 0))) != dim:
+                continue
+            for field, value in fields.items():
+                name, _, position = field.decode().partition(":")
+                if name == "a":
+                    a[i].flat[int(position)] = float(value)
+                elif name == "b":
+                    b[i][int(position)] = float(value)
+            pulls[i] = float(fields.get(b"pulls", 0))
+        return a, b, pulls
+
+    def add(self, arms, a, b, pulls):
+        dim = a.shape[-1]
+        pipe = self.client.pipeline(transaction=True)
+        for i in np.flatnonzero(pulls):
+            key = self.prefix + _arm_key(arms[i])
+            pipe.hset(key, "dim", dim)
+            for position, value in enumerate(a[i].flat):
+                if value:
+                    pipe.hincrbyfloat(key, f"a:{position}", float(value))
+            for position, value in enumerate(b[i]):
+                if value:
+                    pipe.hincrbyfloat(key, f"b:{position}", float(value))
+            pipe.hincrbyfloat(key, "pulls", float(pulls[i]))
+        pipe.execute()
+
+
+def make_policy_store(name=POLICY_BACKEND):
+    if name == "redis":
+        try:
+            store = RedisPolicyStore()
+            store.client.ping()
+            return store
+        except Exception as e:
+            logging.warning(f"Redis policy store unavailable, using SQLite: {e}")
+    return SQLitePolicyStore()
+
+
+# --- Policy ---
+
+
+class StepPolicy:
+    """LinUCB contextual bandit choosing (max_steps, max_replan_rounds) for a query.
+
+    All arms are scored in one vectorized pass over cached inverses, so a
+    lookup takes tens of microseconds. Feedback is applied in memory at once
+    and written to the store in batches by a background thread, which also
+    picks up feedback recorded by other processes.
+    """
+
+    def __init__(self, store=None, alpha=POLICY_ALPHA, flush_seconds=POLICY_FLUSH_SECONDS, arms=ARMS):
+        self.store = store
+        self.alpha = alpha
+        self.flush_seconds = flush_seconds
+        self.arms = list(arms)
+        self._lock = threading.Lock()
+        shape = (len(self.arms), FEATURE_DIM)
+        self._pending = (np.zeros(shape + (FEATURE_DIM,)), np.zeros(shape), np.zeros(len(self.arms)))
+        # The first feature is a constant 1, so this sets the prior arm's intercept.
+        self._prior_b = np.zeros(shape)
+        if PRIOR_ARM in self.arms:
+            self._prior_b[self.arms.index(PRIOR_ARM), 0] = PRIOR_REWARD
+        self._stored = self._load()
+        self._recompute()
+        self._stop = threading.Event()
+        self._thread = None
+        if store is not None:
+            self._thread = threading.Thread(target=self._flush_loop, name="policy-flush", daemon=True)
+            self._thread.start()
+
+    def _load(self):
+        if self.store is None:
+            return tuple(np.zeros_like(part) for part in self._pending)
+        try:
+            return self.store.load(self.arms, FEATURE_DIM)
+        except Exception as e:
+            logging.warning(f"Loading step policy failed, starting empty: {e}")
+            return tuple(np.zeros_like(part) for part in self._pending)
+
+    def _recompute(self):
+        # Ridge-regularized per-arm inverses and coefficients; call with the lock held or before sharing.
+        a = self._stored[0] + self._pending[0] + np.eye(FEATURE_DIM)
+        b = self._stored[1] + self._pending[1] + self._prior_b
+        self._a_inv = np.linalg.inv(a)
+        self._theta = np.einsum("kij,kj->ki", self._a_inv, b)
+
+    def choose(self, query):
+        """Return (max_steps, max_replan_rounds) for ``query``."""
+        x = query_features(query)
+        with self._lock:
+            a_inv, theta = self._a_inv, self._theta
+        scores = theta @ x + self.alpha * np.sqrt(np.einsum("i,kij,j->k", x, a_inv, x))
+        # Ties (for example before any feedback) are broken at random.
+        best = np.flatnonzero(scores >= scores.max() - 1e-9)
+        return self.arms[int(np.random.choice(best))]
+
+    def update(self, query, arm, reward):
+        """Record ``reward`` for having run ``query`` with ``arm`` = (max_steps, max_replan_rounds)."""
+        if tuple(arm) not in self.arms:
+            logging.warning(f"Ignoring feedback for {arm}, which the step policy does not choose")
+            return
+        i = self.arms.index(tuple(arm))
+        x = query_features(query)
+        with self._lock:
+            self._pending[0][i] += np.outer(x, x)
+            self._pending[1][i] += reward * x
+            self._pending[2][i] += 1
+            self._recompute()
+
+    def flush(self):
+        """Write buffered feedback to the store and reload the combined statistics."""
+        if self.store is None:
+            return
+        with self._lock:
+            pending = self._pending
+            if not pending[2].any():
+                pending = None
+            else:
+                self._pending = tuple(np.zeros_like(part) for part in pending)
+                # Until the reload below, the flushed feedback counts as stored.
+                self._stored = tuple(s + p for s, p in zip(self._stored, pending))
+        if pending is not None:
+            try:
+                self.store.add(self.arms, *pending)
+            except Exception as e:
+                logging.warning(f"Step policy write failed; keeping feedback for the next flush: {e}")
+                with self._lock:
+                    self._stored = tuple(s - p for s, p in zip(self._stored, pending))
+                    self._pending = tuple(q + p for q, p in zip(self._pending, pending))
+                return
+        try:
+            stored = self.store.load(self.arms, FEATURE_DIM)
+        except Exception as e:
+            logging.warning(f"Step policy reload failed: {e}")
+            return
+        with self._lock:
+            self._stored = stored
+            self._recompute()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_seconds)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pulls = self._stored[2] + self._pending[2]
+        return {
+            f"{steps} steps, replan limit {replans}": int(n) for (steps, replans), n in zip(self.arms, pulls) if n
+        }
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_step_policy():
+    """The process-wide StepPolicy, created on first use; pending feedback is flushed at exit."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = StepPolicy(make_policy_store())
+            atexit.register(_policy.close)
+        return _policy
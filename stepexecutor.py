@@ -1,22 +1,24 @@
 import streamlit as st
-from web_agent import search_google
+from web_agent import search_google, SEARCH_ERROR_MESSAGE
 from dotenv import load_dotenv
 from config import client
+from concurrent.futures import ThreadPoolExecutor, wait
+import json
+import logging
+import os
+import time
+from tracing import span, submit
 
 load_dotenv()
 
+# Limits for the tool-calling loop of a single step.
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "3"))
+MAX_TOOL_SECONDS = float(os.getenv("MAX_TOOL_SECONDS", "90"))
 
-def execute_step(step, context):
-    """Execute a single research step using function calling and web search."""
-    exec_prompt = (
-        f"You are an autonomous research agent. Execute the following research step:\n\n"
-        f"Step: {step}\n\n"
-        f"Context so far: {context}\n\n"
-        "Include even the most minor details in your response. "
-        "Always search over the internet regarding the relevant details and include content from that, use the search_google function."
-    )
-    functions = [
-        {
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
             "name": "search_google",
             "description": "Searches Google and returns relevant web results for a query.",
             "parameters": {
@@ -29,26 +31,113 @@ def execute_step(step, context):
                 },
                 "required": ["query"],
             },
-        }
-    ]
+        },
+    }
+]
+TOOL_FUNCTIONS = {"search_google": search_google}
+# Tools that are also given the step being executed, to rank their output against it.
+STEP_AWARE_TOOLS = {"search_google"}
+# Tool results that report a failure rather than content.
+TOOL_ERROR_PREFIXES = ("Unknown tool:", "Tool error:", SEARCH_ERROR_MESSAGE)
+
+# Tool calls from all steps share one pool, so a call that overruns the step's
+# tool budget keeps running in the background instead of blocking the step.
+_tool_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MAX_PARALLEL_TOOL_CALLS", "8")),
+    thread_name_prefix="tool-call",
+)
+
+
+def run_tool_call(tool_call, step=None):
+    """Run one tool call for ``step`` and return (content, seconds, status)."""
+    started = time.perf_counter()
+    with span(tool_call.function.name, "tool", arguments=tool_call.function.arguments) as tool_span:
+        func = TOOL_FUNCTIONS.get(tool_call.function.name)
+        if func is None:
+            content = f"Unknown tool: {tool_call.function.name}"
+        else:
+            try:
+                arguments = json.loads(tool_call.function.arguments)
+                if step is not None and tool_call.function.name in STEP_AWARE_TOOLS:
+                    arguments["step"] = step
+                content = func(**arguments)
+            except Exception as e:
+                logging.error(f"Tool call {tool_call.function.name} failed: {e}")
+                content = f"Tool error: {str(e)}"
+        # Tools report failures in their result, so the span status is taken from it.
+        status = "error" if str(content).startswith(TOOL_ERROR_PREFIXES) else "ok"
+        if status == "error":
+            tool_span.status = "error"
+            tool_span.set(error=str(content)[:200])
+    return content, time.perf_counter() - started, status
+
+
+def execute_step(step, context, trace=None):
+    """Execute a single research step using function calling and web search.
+
+    The model may request several searches per turn; they run concurrently,
+    for up to MAX_TOOL_ROUNDS turns and MAX_TOOL_SECONDS of tool time. Each
+    tool call is appended to ``trace`` (if given) with its latency.
+    """
+    exec_prompt = (
+        f"You are an autonomous research agent. Execute the following research step:\n\n"
+        f"Step: {step}\n\n"
+        f"Context so far: {context}\n\n"
+        "Include even the most minor details in your response. "
+        "Always search over the internet regarding the relevant details and include content from that, use the search_google function. "
+        "If the step needs several searches, request them all at once."
+    )
     messages = [
         {"role": "system", "content": "You are a research execution agent."},
         {"role": "user", "content": exec_prompt},
     ]
-    response = client.chat.completions.create(
-        model="gpt-4.1", messages=messages, functions=functions, function_call="auto"
-    )
-    msg = response.choices[0].message
+    trace = [] if trace is None else trace
+    deadline = time.monotonic() + MAX_TOOL_SECONDS
 
-    if msg.function_call and msg.function_call.name == "search_google":
-        import json
+    for round_idx in range(MAX_TOOL_ROUNDS):
+        response = client.chat.completions.create(
+            model="gpt-4.1", messages=messages, tools=TOOLS, tool_choice="auto"
+        )
+        msg = response.choices[0].message
+        if not msg.tool_calls:
+            if trace:
+                logging.info(f"Tool trace for step '{step}': {trace}")
+            return msg.content
 
-        search_args = json.loads(msg.function_call.arguments)
-        web_results = search_google(search_args["query"])
         messages.append(
-            {"role": "function", "name": "search_google", "content": web_results}
+            {
+                "role": "assistant",
+                "content": msg.content,
+                "tool_calls": [tool_call.model_dump() for tool_call in msg.tool_calls],
+            }
         )
-        response2 = client.chat.completions.create(model="gpt-4.1", messages=messages)
-        return response2.choices[0].message.content
-    else:
-        return msg.content
+        futures = {
+            submit(_tool_executor, run_tool_call, tool_call, step): tool_call
+            for tool_call in msg.tool_calls
+        }
+        wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        for future, tool_call in futures.items():
+            if future.done():
+                content, seconds, status = future.result()
+            else:
+                content, seconds, status = "Tool call timed out.", None, "timeout"
+            trace.append(
+                {
+                    "round": round_idx + 1,
+                    "tool": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                    "seconds": seconds,
+                    "status": status,
+                }
+            )
+            messages.append(
+                {"role": "tool", "tool_call_id": tool_call.id, "content": content}
+            )
+        if time.monotonic() >= deadline:
+            break
+
+    logging.info(f"Tool trace for step '{step}': {trace}")
+    response = client.chat.completions.create(
+        model="gpt-4.1", messages=messages, tools=TOOLS, tool_choice="none"
+    )
+    return response.choices[0].message.content
@@ -0,0 +1,245 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Directory where per-run trace files are written.
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_counts_lock = threading.Lock()
+
+
+class Span:
+    """One timed operation; ``kind`` groups spans in the summary (llm, provider, step, ...)."""
+
+    def __init__(self, name, kind, trace_id, parent, attributes):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def seconds(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Trace:
+    """All spans of one research run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    # --- Export ---
+
+    def to_otlp(self):
+        """The trace in OpenTelemetry OTLP/JSON layout."""
+
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = [
+            {
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [attribute("deepquest.kind", s.kind)]
+                + [attribute(k, v) for k, v in s.attributes.items() if v is not None],
+                "status": {"code": 1 if s.status == "ok" else 2},
+            }
+            for s in self.spans
+        ]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [attribute("service.name", "deepquest")]},
+                    "scopeSpans": [{"scope": {"name": "deepquest.tracing"}, "spans": spans}],
+                }
+            ]
+        }
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f)
+        return path
+
+    # --- Summary ---
+
+    def totals(self):
+        """Per-kind count, wall time and token usage."""
+        totals = {}
+        for s in self.spans:
+            row = totals.setdefault(s.kind, {"count": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+            row["count"] += 1
+            row["seconds"] += s.seconds
+            row["prompt_tokens"] += s.attributes.get("prompt_tokens") or 0
+            row["completion_tokens"] += s.attributes.get("completion_tokens") or 0
+        return totals
+
+    def critical_path(self):
+        """(depth, span) pairs on the critical path of the run.
+
+        Walking back from a span's end, the critical child is the one that
+        finished last; before it, the one that finished last before that child
+        started, and so on. Each critical child is expanded the same way.
+        """
+        children = {}
+        for s in self.spans:
+            children.setdefault(s.parent_id, []).append(s)
+
+        def expand(current, depth):
+            path = [(depth, current)]
+            chain = []
+            cursor = current.end_ns or 0
+            for child in sorted(children.get(current.span_id, []), key=lambda s: -(s.end_ns or 0)):
+                if (child.end_ns or 0) <= cursor:
+                    chain.append(child)
+                    cursor = child.start_ns
+            for child in reversed(chain):
+                path += expand(child, depth + 1)
+            return path
+
+        roots = children.get(None, [])
+        return expand(max(roots, key=lambda s: s.end_ns or 0), 0) if roots else []
+
+    def format_summary(self):
+        lines = [f"Trace {self.name} ({self.trace_id})", "", "kind        count   seconds   prompt_tok  completion_tok"]
+        for kind, row in sorted(self.totals().items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(
+                f"{kind:<10} {row['count']:>6} {row['seconds']:>9.2f} {row['prompt_tokens']:>12} {row['completion_tokens']:>15}"
+            )
+        reduced = [
+            s for s in self.spans
+            if s.kind == "step" and (s.attributes.get("bytes_downloaded") or s.attributes.get("search_tokens_full"))
+        ]
+        if reduced:
+            lines += ["", "Context reduction per step (extraction bytes, packed search tokens, dedup):"]
+            for s in reduced:
+                downloaded, kept = s.attributes.get("bytes_downloaded", 0), s.attributes.get("bytes_kept", 0)
+                full, sent = s.attributes.get("search_tokens_full", 0), s.attributes.get("search_tokens_sent", 0)
+                lines.append(
+                    f"  {s.name[:60]}: {downloaded // 1024} KB -> {kept // 1024} KB, "
+                    f"{full} -> {sent} tokens, {s.attributes.get('dedup_fetches_saved', 0)} fetches and "
+                    f"{s.attributes.get('dedup_tokens_saved', 0)} tokens deduplicated"
+                )
+        waited = [
+            s for s in self.spans if s.kind in ("llm", "provider") and s.attributes.get("rate_limit_wait_seconds")
+        ]
+        if waited:
+            total = sum(s.attributes["rate_limit_wait_seconds"] for s in waited)
+            lines += ["", f"Rate limit queueing: {len(waited)} LLM and provider calls waited {total:.2f}s in total"]
+        lines += ["", "Critical path:"]
+        for depth, s in self.critical_path():
+            lines.append(f"{'  ' * depth}{s.kind}:{s.name} {s.seconds:.2f}s")
+        return "\n".join(lines)
+
+
+@contextmanager
+def span(name, kind="internal", **attributes):
+    """Time a block as a child of the current span; a no-op outside a trace."""
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    current = Span(name, kind, trace.trace_id if trace else None, parent, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.set(error=str(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        if trace is not None:
+            trace.add(current)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """Start a new trace with a root span; yields the Trace."""
+    trace = Trace(name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, "run", **attributes):
+            yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def add_counts(**counts):
+    """Add numeric ``counts`` to the current span's attributes and to every span above it."""
+    current = _current_span.get()
+    with _counts_lock:
+        while current is not None:
+            for key, value in counts.items():
+                current.attributes[key] = current.attributes.get(key, 0) + value
+            current = current.parent
+
+
+def traced(kind, name=None):
+    """Decorator that wraps every call of a function in a span."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__, kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def submit(executor, func, *args, **kwargs):
+    """``executor.submit`` that carries the current trace into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def export_trace(trace, directory=TRACE_DIR):
+    """Write ``trace`` as OTLP/JSON and log its summary table; returns the file path."""
+    path = trace.export(os.path.join(directory, f"{trace.trace_id}.json"))
+    logging.info(f"Trace written to {path}\n{trace.format_summary()}")
+    return path
@@ -1,16 +1,39 @@
-import requests
 import os
-import urllib.request
+import re
 import urllib.parse
 import xml.etree.ElementTree as ET
 from newsapi import NewsApiClient
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-import aiohttp
 import asyncio
 import logging
-from crawl4ai import AsyncWebCrawler
-import time
+from crawler_pool import get_crawler_pool
+from dedup import current_dedup_index
+from cache import crawl_cache, search_cache
+from http_client import get_async_pool, get_session, http_get, http_stats
+from resilience import (
+    ProviderError,
+    async_call_with_retry,
+    get_breaker,
+    hedged,
+    raise_for_retryable_status,
+    resilience_stats,
+    resilient,
+)
+from ranking import BM25Index, chunk_text, estimate_tokens, pack_passages
+from ratelimit import get_rate_limiter, ratelimit_stats
+from source_selector import get_source_selector, record_provider_results, select_providers
+from extract import (
+    EXTRACT_MAX_BYTES,
+    PageTooLarge,
+    declared_size,
+    extraction_stats,
+    read_head,
+    record_extraction,
+    strip_boilerplate,
+)
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from tracing import add_counts, span, traced
 
 # Setup logging
 logging.basicConfig(
@@ -25,56 +48,33 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")
 
+# Provider endpoints; overridable to route through a proxy or local stand-ins.
+GOOGLE_SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://www.googleapis.com/customsearch/v1")
+ARXIV_API_URL = os.getenv("ARXIV_API_URL", "http://export.arxiv.org/api/query")
+SEC_API_URL = os.getenv("SEC_API_URL", "https://www.sec.gov/cgi-bin/browse-edgar")
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php")
+
 HEADERS = {
     "User-Agent": "MyApp/1.0 (contact@example.com)"  # Customize this with your contact
 }
 
-# --- Retry Decorator ---
-def retry_on_exception(max_retries=2, backoff=2):
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            last_exception = None
-            for attempt in range(max_retries + 1):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_exception = e
-                    logging.warning(
-                        f"Attempt {attempt+1} failed for {func.__name__}: {e}"
-                    )
-                    if attempt < max_retries:
-                        time.sleep(backoff)
-            logging.error(f"All retries failed for {func.__name__}: {last_exception}")
-            raise last_exception
-        return wrapper
-    return decorator
-
-# --- Asynchronous Retry Helper ---
-async def async_retry_on_exception(func, *args, max_retries=2, backoff=2, **kwargs):
-    last_exception = None
-    for attempt in range(max_retries + 1):
-        try:
-            return await func(*args, **kwargs)
-        except Exception as e:
-            last_exception = e
-            logging.warning(
-                f"Async attempt {attempt+1} failed for {func.__name__}: {e}"
-            )
-            if attempt < max_retries:
-                await asyncio.sleep(backoff)
-    logging.error(f"All async retries failed for {func.__name__}: {last_exception}")
-    raise last_exception
-
 # --- Asynchronous Utilities ---
 
-async def fetch_url(session, url, timeout=10):
-    try:
+async def fetch_url(url, timeout=10):
+    async def fetch_with(session):
         async with session.get(url, timeout=timeout) as response:
             if response.status == 200:
-                return await response.text()
-            else:
-                logging.warning(f"Non-200 response for {url}: {response.status}")
-                return None
+                # Pages beyond the per-page cap are truncated rather than read in full.
+                raw = await response.content.read(EXTRACT_MAX_BYTES)
+                return raw.decode(response.charset or "utf-8", errors="replace"), dict(response.headers)
+            logging.warning(f"Non-200 response for {url}: {response.status}")
+            return None, {}
+
+    async def fetch():
+        return await get_async_pool().run(fetch_with)
+
+    try:
+        return await crawl_cache.fetch(url, fetch, kind="html")
     except asyncio.TimeoutError:
         logging.error(f"Timeout fetching {url}")
         return None
@@ -82,105 +82,151 @@ async def fetch_url(session, url, timeout=10):
         logging.error(f"Error fetching {url}: {e}")
         return None
 
+async def fetch_page_summary(url, timeout=10):
+    """Return "title\ndescription" for a page, reading only as far as its <head>."""
+
+    async def fetch_with(session):
+        async with session.get(url, timeout=timeout) as response:
+            if response.status != 200:
+                logging.warning(f"Non-200 response for {url}: {response.status}")
+                return None, {}
+            title, description, downloaded = await read_head(response, EXTRACT_MAX_BYTES)
+            summary = f"{title or 'No title found'}\n{description or 'No description found'}"
+            record_extraction(url, downloaded, len(summary.encode("utf-8")))
+            return summary, dict(response.headers)
+
+    async def fetch():
+        return await get_async_pool().run(fetch_with)
+
+    return await crawl_cache.fetch(url, fetch, kind="head")
+
 async def crawl_websites(urls, timeout=10):
     crawled_results = []
     try:
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                async_retry_on_exception(fetch_url, session, url, timeout=timeout)
-                for url in urls
-            ]
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            for idx, content in enumerate(responses):
-                if isinstance(content, Exception):
-                    logging.error(f"Exception during crawling {urls[idx]}: {content}")
-                    crawled_results.append(
-                        f"[Crawled Website {idx + 1}] Error fetching content: {content}"
-                    )
-                elif content:
-                    soup = BeautifulSoup(content, "html.parser")
-                    title = soup.title.string if soup.title else "No title found"
-                    description = soup.find("meta", attrs={"name": "description"})
-                    description = (
-                        description["content"]
-                        if description
-                        else "No description found"
-                    )
-                    crawled_results.append(
-                        f"[Crawled Website {idx + 1}] {title}\nDescription: {description}"
-                    )
-                else:
-                    crawled_results.append(
-                        f"[Crawled Website {idx + 1}] Error fetching content"
-                    )
+        tasks = [
+            async_call_with_retry("Web", fetch_page_summary, url, timeout=timeout)
+            for url in urls
+        ]
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        for idx, content in enumerate(responses):
+            if isinstance(content, Exception):
+                logging.error(f"Exception during crawling {urls[idx]}: {content}")
+                crawled_results.append(
+                    f"[Crawled Website {idx + 1}] Error fetching content: {content}"
+                )
+            elif content:
+                title, description = content.split("\n", 1)
+                crawled_results.append(
+                    f"[Crawled Website {idx + 1}] {title}\nDescription: {description}"
+                )
+            else:
+                crawled_results.append(
+                    f"[Crawled Website {idx + 1}] Error fetching content"
+                )
     except Exception as e:
         logging.error(f"Error in crawl_websites: {e}")
     return crawled_results
 
 async def crawl_with_async_webcrawler(urls, timeout=20):
-    crawl_results = []
-    try:
-        async with AsyncWebCrawler() as crawler:
-            for url in urls:
-                try:
-                    result = await asyncio.wait_for(
-                        async_retry_on_exception(
-                            crawler.arun, url=url, max_retries=2, backoff=2
-                        ),
-                        timeout=timeout,
-                    )
-                    crawl_results.append(
-                        f"[Crawled Website (Markdown)] URL: {url}\n{result.markdown}\n"
-                    )
-                except asyncio.TimeoutError:
-                    logging.error(f"Timeout crawling {url} with AsyncWebCrawler")
-                    crawl_results.append(f"[Crawling Error] URL: {url} Error: Timeout")
-                except Exception as e:
-                    logging.error(f"Error crawling {url} with AsyncWebCrawler: {e}")
-                    crawl_results.append(f"[Crawling Error] URL: {url} Error: {str(e)}")
-    except Exception as e:
-        logging.error(f"Error initializing AsyncWebCrawler: {e}")
+    """Crawl URLs concurrently on the shared crawler pool, returning results in URL order."""
+    pool = get_crawler_pool()
+    dedup = current_dedup_index()
+
+    async def crawl_page(url):
+        # The crawler reports failed pages in the result rather than raising.
+        result = await pool.arun(url)
+        if not getattr(result, "success", True):
+            status = getattr(result, "status_code", None)
+            raise ProviderError(f"{getattr(result, 'error_message', None) or 'crawl failed'} (status {status})", status)
+        return result
+
+    async def render(url):
+        # The browser cannot stop part way through a page, so oversized pages are skipped up front.
+        size = await get_async_pool().run(lambda session: declared_size(session, url))
+        if size is not None and size > EXTRACT_MAX_BYTES:
+            raise PageTooLarge(f"page is {size} bytes, over the {EXTRACT_MAX_BYTES} byte cap")
+        # One breaker per host: a few broken sites must not stop all crawling.
+        host = urllib.parse.urlsplit(url).hostname or url
+        result = await async_call_with_retry(f"Crawler {host}", crawl_page, url)
+        markdown = str(result.markdown or "")
+        # Only the main content is cached and passed on to the LLM.
+        content = strip_boilerplate(markdown)
+        downloaded = len((getattr(result, "html", None) or markdown).encode("utf-8"))
+        record_extraction(url, downloaded, len(content.encode("utf-8")))
+        return content, getattr(result, "response_headers", None) or {}
+
+    async def crawl_one(url):
+        # Pages already in this step's context are referenced instead of sent again.
+        if dedup is not None and dedup.claim_url(url):
+            return f"[Crawled Website (Duplicate)] URL: {url}\nAlready retrieved by this step or a step it builds on."
+        try:
+            with span(url, "crawler"):
+                markdown = await asyncio.wait_for(
+                    crawl_cache.fetch(url, lambda: render(url), kind="markdown"),
+                    timeout=timeout,
+                )
+            earlier = dedup.find_duplicate(url, markdown) if dedup is not None and markdown else None
+            if earlier:
+                return f"[Crawled Website (Duplicate)] URL: {url}\nSame content as {earlier}, retrieved by this step or a step it builds on."
+            return f"[Crawled Website (Markdown)] URL: {url}\n{markdown}\n"
+        except asyncio.TimeoutError:
+            logging.error(f"Timeout crawling {url} with AsyncWebCrawler")
+            if dedup is not None:
+                dedup.release_url(url)
+            return f"[Crawling Error] URL: {url} Error: Timeout"
+        except Exception as e:
+            logging.error(f"Error crawling {url} with AsyncWebCrawler: {e}")
+            if dedup is not None:
+                dedup.release_url(url)
+            return f"[Crawling Error] URL: {url} Error: {str(e)}"
+
+    crawl_results = list(await asyncio.gather(*(crawl_one(url) for url in urls)))
+    logging.info(f"Crawler pool stats: {pool.stats()}")
+    logging.info(f"Crawl cache stats: {crawl_cache.stats()}")
+    logging.info(f"Extraction stats: {extraction_stats.stats()}")
     return crawl_results
 
 # --- Synchronous Main Search Function ---
 
-@retry_on_exception(max_retries=2, backoff=2)
+@resilient("Google")
 def google_search_api_call(google_search_url, google_params):
     try:
-        response = requests.get(google_search_url, params=google_params, timeout=15)
+        # Every attempt spends one query of the daily CSE quota.
+        get_rate_limiter().acquire({"google:queries": 1}, max_wait=PROVIDER_DEADLINES["Google"])
+        response = http_get(google_search_url, params=google_params)
         response.raise_for_status()
         return response
     except Exception as e:
         logging.error(f"Error in google_search_api_call: {e}")
         raise
 
-@retry_on_exception(max_retries=2, backoff=2)
+@resilient("ArXiv")
 def arxiv_api_call(arxiv_url):
     try:
-        req = urllib.request.Request(arxiv_url, headers=HEADERS)
-        with urllib.request.urlopen(req, timeout=15) as response:
-            return response.read().decode("utf-8")
+        response = http_get(arxiv_url, headers=HEADERS)
+        response.raise_for_status()
+        return response.text
     except Exception as e:
         logging.error(f"Error in arxiv_api_call: {e}")
         raise
 
-@retry_on_exception(max_retries=2, backoff=2)
+@resilient("SEC")
 def sec_api_call(sec_url):
     try:
-        return requests.get(sec_url, headers=HEADERS, timeout=15)
+        return raise_for_retryable_status(http_get(sec_url, headers=HEADERS))
     except Exception as e:
         logging.error(f"Error in sec_api_call: {e}")
         raise
 
-@retry_on_exception(max_retries=2, backoff=2)
+@resilient("Wikipedia")
 def wikipedia_api_call(wikipedia_url, wiki_params):
     try:
-        return requests.get(wikipedia_url, params=wiki_params, timeout=10)
+        return raise_for_retryable_status(http_get(wikipedia_url, params=wiki_params))
     except Exception as e:
         logging.error(f"Error in wikipedia_api_call: {e}")
         raise
 
-@retry_on_exception(max_retries=2, backoff=2)
+@resilient("NewsAPI")
 def newsapi_call(newsapi, query):
     try:
         return newsapi.get_everything(
@@ -190,132 +236,443 @@ def newsapi_call(newsapi, query):
         logging.error(f"Error in newsapi_call: {e}")
         raise
 
-def search_google(query):
+_newsapi = None
+
+
+def get_newsapi():
+    """One NewsApiClient for the process, on the shared pooled session."""
+    global _newsapi
+    if _newsapi is None:
+        _newsapi = NewsApiClient(api_key=NEWSAPI_KEY, session=get_session())
+    return _newsapi
+
+# --- Provider Searches ---
+# Each provider returns a list of formatted result strings. Errors are reported
+# inline in the same way the combined search has always reported them.
+
+@traced("provider", "Google")
+def google_search(query):
+    """Query Google Custom Search and return (formatted results, result URLs)."""
+    formatted_results = []
+    google_urls = []
+    google_search_url = GOOGLE_SEARCH_URL
+    google_params = {
+        "key": GOOGLE_API_KEY,
+        "cx": SEARCH_ENGINE_ID,
+        "q": query,
+        "num": 5,
+    }
     try:
-        formatted_results = []
-        crawled_data = []
-        logging.info(f"Query: {query}")
+        data = search_cache.get_or_call(
+            "Google",
+            query,
+            lambda: google_search_api_call(google_search_url, google_params).json(),
+        )
+        for i, item in enumerate(data.get("items", [])):
+            formatted_results.append(
+                f"[Google Result {i + 1}] {item['title']} - {item['displayLink']}\n{item['snippet']}"
+            )
+            google_urls.append(item["link"])
+    except Exception as e:
+        logging.error(f"Google Search Error: {e}")
+        formatted_results.append(f"Google Search Error: {str(e)}")
+        google_urls = []
+    return formatted_results, google_urls
+
+@traced("provider", "ArXiv")
+def arxiv_search(query):
+    formatted_results = []
+    try:
+        encoded_query = urllib.parse.quote(query)
+        arxiv_url = f"{ARXIV_API_URL}?search_query=all:{encoded_query}&start=0&max_results=3"
+        xml_data = search_cache.get_or_call("ArXiv", query, lambda: arxiv_api_call(arxiv_url))
+        root = ET.fromstring(xml_data)
+        ns = {"arxiv": "http://www.w3.org/2005/Atom"}
+        entries = root.findall("arxiv:entry", ns)
+        for i, entry in enumerate(entries):
+            title = entry.find("arxiv:title", ns)
+            summary = entry.find("arxiv:summary", ns)
+            link = entry.find("arxiv:id", ns)
+            title_text = title.text.strip() if title is not None else "No title"
+            summary_text = (
+                summary.text.strip()[:300] + "..."
+                if summary is not None
+                else "No summary"
+            )
+            url_line = f"\nURL: {link.text.strip()}" if link is not None and link.text else ""
+            formatted_results.append(
+                f"[ArXiv Result {i + 1}] {title_text}{url_line}\nSummary: {summary_text}"
+            )
+    except Exception as e:
+        logging.error(f"ArXiv Search Error: {e}")
+        formatted_results.append(f"ArXiv Search Error: {str(e)}")
+    return formatted_results
+
+@traced("provider", "NewsAPI")
+def news_search(query):
+    formatted_results = []
+    try:
+        newsapi = get_newsapi()
+        articles = search_cache.get_or_call("NewsAPI", query, lambda: newsapi_call(newsapi, query))
+        for i, article in enumerate(articles.get("articles", [])):
+            formatted_results.append(
+                f"[News {i + 1}] {article['title']} ({article['source']['name']})\n{article['description']}\nURL: {article['url']}"
+            )
+    except Exception as e:
+        logging.error(f"NewsAPI Error: {e}")
+        formatted_results.append(f"NewsAPI Error: {str(e)}")
+    return formatted_results
+
+# EDGAR looks up one company by name prefix or ticker, not a free-text query.
+TICKER_PATTERN = re.compile(r"(?:\b(?:NYSE|NASDAQ|Nasdaq|AMEX)\s*:\s*|\$|\()([A-Z]{1,5}(?:\.[A-Z])?)\b\)?")
+COMPANY_SUFFIX_PATTERN = re.compile(
+    r"\b((?:[A-Z][\w&'.-]*\s+){0,3}?[A-Z][\w&'.-]*?),?\s+(?:Inc|Corp|Corporation|Co|Company|Ltd|LLC|PLC|Holdings|Group)\b"
+)
+CAPITALIZED_RUN_PATTERN = re.compile(r"\b[A-Z][\w&.-]*(?:'s)?(?:\s+[A-Z][\w&.-]*(?:'s)?)*")
+# Capitalized words that start questions and instructions or name filings rather than companies.
+NOT_COMPANY_WORDS = set(
+    "what how why which who when where does do did is are was were the a an in on for of and or "
+    "analyze analyse research investigate examine identify find compare review summarize list get show search "
+    "look evaluate assess determine explore describe explain latest recent current sec edgar securities exchange "
+    "commission annual quarterly report reports filing filings form forms revenue earnings financial financials "
+    "q1 q2 q3 q4".split()
+)
+
+
+def sec_company(text):
+    """("ticker", symbol) or ("company", name) named in ``text``, or None."""
+    for ticker in TICKER_PATTERN.findall(text):
+        if ticker.lower() not in NOT_COMPANY_WORDS:
+            return "ticker", ticker
+    names = [m.group(1) for m in COMPANY_SUFFIX_PATTERN.finditer(text)] + CAPITALIZED_RUN_PATTERN.findall(text)
+    for name in names:
+        words = [w.removesuffix("'s") for w in name.split()]
+        while words and words[0].lower() in NOT_COMPANY_WORDS:
+            words.pop(0)
+        while words and words[-1].lower() in NOT_COMPANY_WORDS:
+            words.pop()
+        if words:
+            return "company", " ".join(words)
+    return None
 
-        # --- Google Custom Search ---
-        google_search_url = "https://www.googleapis.com/customsearch/v1"
-        google_params = {
-            "key": GOOGLE_API_KEY,
-            "cx": SEARCH_ENGINE_ID,
-            "q": query,
-            "num": 5,
-        }
-        try:
-            response = google_search_api_call(google_search_url, google_params)
-            data = response.json()
-            google_urls = []
-            for i, item in enumerate(data.get("items", [])):
-                formatted_results.append(
-                    f"[Google Result {i + 1}] {item['title']} - {item['displayLink']}\n{item['snippet']}"
-                )
-                google_urls.append(item["link"])
-        except Exception as e:
-            logging.error(f"Google Search Error: {e}")
-            formatted_results.append(f"Google Search Error: {str(e)}")
-            google_urls = []
 
-        # --- Crawl the top 3 websites (asynchronously) using AsyncWebCrawler ---
-        if google_urls:
+@traced("provider", "SEC")
+def sec_search(query):
+    formatted_results = []
+    try:
+        company = sec_company(query)
+        if company is None:
+            return [f"SEC API: No company or ticker named in '{query}'."]
+        kind, name = company
+        lookup = f"CIK={urllib.parse.quote(name)}" if kind == "ticker" else f"company={urllib.parse.quote(name)}"
+        sec_url = f"{SEC_API_URL}?{lookup}&action=getcompany&output=atom&count=5"
+
+        def call_sec():
+            sec_response = sec_api_call(sec_url)
+            if sec_response.status_code != 200:
+                return {"status_code": sec_response.status_code}
+            # A company match is an Atom feed of its latest filings; anything else has no entries.
+            filings = []
             try:
-                crawled_data = asyncio.run(crawl_with_async_webcrawler(google_urls[:3]))
-                logging.info(f"Crawled URLs: {google_urls[:3]}")
-            except Exception as e:
-                logging.error(f"Error running async crawler: {e}")
-                crawled_data.append(f"Async Crawler Error: {str(e)}")
+                ns = {"atom": "http://www.w3.org/2005/Atom"}
+                for entry in ET.fromstring(sec_response.text).findall("atom:entry", ns):
+                    link = entry.find("atom:link", ns)
+                    filings.append(
+                        {
+                            "title": (entry.findtext("atom:title", "", ns) or "").strip(),
+                            "updated": (entry.findtext("atom:updated", "", ns) or "")[:10],
+                            "url": link.get("href") if link is not None else "",
+                        }
+                    )
+            except ET.ParseError:
+                pass
+            return {"status_code": 200, "filings": filings}
 
-        # --- ArXiv Search ---
-        try:
-            encoded_query = urllib.parse.quote(query)
-            arxiv_url = f"http://export.arxiv.org/api/query?search_query=all:{encoded_query}&start=0&max_results=3"
-            xml_data = arxiv_api_call(arxiv_url)
-            root = ET.fromstring(xml_data)
-            ns = {"arxiv": "http://www.w3.org/2005/Atom"}
-            entries = root.findall("arxiv:entry", ns)
-            for i, entry in enumerate(entries):
-                title = entry.find("arxiv:title", ns)
-                summary = entry.find("arxiv:summary", ns)
-                title_text = title.text.strip() if title is not None else "No title"
-                summary_text = (
-                    summary.text.strip()[:300] + "..."
-                    if summary is not None
-                    else "No summary"
-                )
+        sec_data = search_cache.get_or_call(
+            "SEC", f"{kind}:{name}", call_sec, should_cache=lambda d: d["status_code"] == 200
+        )
+        if sec_data["status_code"] == 200:
+            if not sec_data["filings"]:
                 formatted_results.append(
-                    f"[ArXiv Result {i + 1}] {title_text}\nSummary: {summary_text}"
+                    f"SEC API: No filings found for '{name}'."
                 )
-        except Exception as e:
-            logging.error(f"ArXiv Search Error: {e}")
-            formatted_results.append(f"ArXiv Search Error: {str(e)}")
-
-        # --- NewsAPI Search ---
-        try:
-            newsapi = NewsApiClient(api_key=NEWSAPI_KEY)
-            articles = newsapi_call(newsapi, query)
-            for i, article in enumerate(articles.get("articles", [])):
+            for i, filing in enumerate(sec_data["filings"]):
                 formatted_results.append(
-                    f"[News {i + 1}] {article['title']} ({article['source']['name']})\n{article['description']}\nURL: {article['url']}"
+                    f"[SEC Filing {i + 1}] {filing['title']} ({filing['updated']})\nURL: {filing['url']}"
                 )
-        except Exception as e:
-            logging.error(f"NewsAPI Error: {e}")
-            formatted_results.append(f"NewsAPI Error: {str(e)}")
+        else:
+            formatted_results.append(
+                f"SEC API Error: {sec_data['status_code']} - Unable to retrieve data from SEC."
+            )
+    except Exception as e:
+        logging.error(f"SEC API Error: {e}")
+        formatted_results.append(f"SEC API Error: {str(e)}")
+    return formatted_results
 
-        # --- SEC API (General Data Search) ---
-        try:
-            sec_url = f"https://www.sec.gov/cgi-bin/browse-edgar?company={urllib.parse.quote(query)}&action=getcompany"
-            sec_response = sec_api_call(sec_url)
-            if sec_response.status_code == 200:
-                if "No matching companies" in sec_response.text:
-                    formatted_results.append(
-                        f"SEC API: No filings found for '{query}'."
-                    )
-                else:
+@traced("provider", "Wikipedia")
+def wikipedia_search(query):
+    formatted_results = []
+    try:
+        wikipedia_url = WIKIPEDIA_API_URL
+        # Steps are sentences, not page titles, so the pages come from a full-text search.
+        wiki_params = {
+            "action": "query",
+            "generator": "search",
+            "gsrsearch": query,
+            "gsrlimit": 2,
+            "prop": "extracts|info",
+            "inprop": "url",
+            "format": "json",
+            "exintro": True,
+            "explaintext": True,
+        }
+
+        def call_wikipedia():
+            wiki_response = wikipedia_api_call(wikipedia_url, wiki_params)
+            if wiki_response.status_code != 200:
+                return {"status_code": wiki_response.status_code}
+            return {"status_code": 200, "data": wiki_response.json()}
+
+        wiki_result = search_cache.get_or_call(
+            "Wikipedia", query, call_wikipedia, should_cache=lambda d: d["status_code"] == 200
+        )
+        if wiki_result["status_code"] == 200:
+            wiki_data = wiki_result["data"]
+            pages = wiki_data.get("query", {}).get("pages", {})
+            for page in sorted(pages.values(), key=lambda p: p.get("index", 0)):
+                extract = page.get("extract")
+                if extract:
                     formatted_results.append(
-                        f"SEC API: Filings and data retrieved for {query}. Check SEC's website for details."
+                        f"[Wikipedia] {page.get('title', '')}\nURL: {page.get('fullurl', '')}\n{extract}"
                     )
-            else:
-                formatted_results.append(
-                    f"SEC API Error: {sec_response.status_code} - Unable to retrieve data from SEC."
-                )
-        except Exception as e:
-            logging.error(f"SEC API Error: {e}")
-            formatted_results.append(f"SEC API Error: {str(e)}")
+        else:
+            formatted_results.append(
+                f"Wikipedia Error: {wiki_result['status_code']}"
+            )
+    except Exception as e:
+        logging.error(f"Wikipedia Error: {e}")
+        formatted_results.append(f"Wikipedia Error: {str(e)}")
+    return formatted_results
 
-        # --- Wikipedia Extract ---
+def crawl_search_results(google_urls):
+    """Crawl the top 3 Google result pages and return their markdown."""
+    crawled_data = []
+    if google_urls:
         try:
-            wikipedia_url = "https://en.wikipedia.org/w/api.php"
-            wiki_params = {
-                "action": "query",
-                "prop": "extracts",
-                "titles": query,
-                "format": "json",
-                "exintro": True,
-                "explaintext": True,
-            }
-            wiki_response = wikipedia_api_call(wikipedia_url, wiki_params)
-            if wiki_response.status_code == 200:
-                wiki_data = wiki_response.json()
-                pages = wiki_data.get("query", {}).get("pages", {})
-                for _, page in pages.items():
-                    extract = page.get("extract")
-                    if extract:
-                        formatted_results.append(f"[Wikipedia]\n{extract}")
-            else:
-                formatted_results.append(
-                    f"Wikipedia Error: {wiki_response.status_code}"
-                )
+            crawled_data = asyncio.run(crawl_with_async_webcrawler(google_urls[:3]))
+            logging.info(f"Crawled URLs: {google_urls[:3]}")
         except Exception as e:
-            logging.error(f"Wikipedia Error: {e}")
-            formatted_results.append(f"Wikipedia Error: {str(e)}")
+            logging.error(f"Error running async crawler: {e}")
+            crawled_data.append(f"Async Crawler Error: {str(e)}")
+    return crawled_data
+
+# Providers in the order their results appear in the combined output.
+SECONDARY_PROVIDERS = {
+    "ArXiv": arxiv_search,
+    "NewsAPI": news_search,
+    "SEC": sec_search,
+    "Wikipedia": wikipedia_search,
+}
+
+# --- Concurrent Fan-out Search ---
+
+SEARCH_FANOUT = os.getenv("SEARCH_FANOUT", "1") == "1"
+# Overall wall-clock budget for one search_google call, in seconds.
+SEARCH_STEP_BUDGET = float(os.getenv("SEARCH_STEP_BUDGET", "30"))
+# Per-provider deadlines, in seconds. The crawler deadline starts once the
+# Google results it depends on have arrived.
+PROVIDER_DEADLINES = {
+    "Google": 20,
+    "Crawler": 25,
+    "ArXiv": 20,
+    "NewsAPI": 20,
+    "SEC": 20,
+    "Wikipedia": 15,
+}
+
+# Providers run on a dedicated pool so that a provider which overruns its
+# deadline never blocks the event loop from shutting down.
+_provider_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SEARCH_PROVIDER_WORKERS", "16")),
+    thread_name_prefix="search-provider",
+)
+
+async def search_google_async(query, step_budget=None, deadlines=None, providers=None, calls=None):
+    """Start all providers at once and collect whatever arrives within the step budget.
+
+    ``providers`` maps the secondary providers to call to their source
+    selection context; by default every provider is called. Their results are
+    recorded for source selection, or appended to ``calls`` as (provider,
+    context, results) when it is given, for the caller to record later.
+    """
+    providers = {name: None for name in SECONDARY_PROVIDERS} if providers is None else providers
+    step_budget = SEARCH_STEP_BUDGET if step_budget is None else step_budget
+    deadlines = {**PROVIDER_DEADLINES, **(deadlines or {})}
+    loop = asyncio.get_running_loop()
+
+    async def run_provider(name, func, *args):
+        # A hedged thread call is not stopped when it loses; see resilience.hedged.
+        def start():
+            return loop.run_in_executor(
+                _provider_executor, contextvars.copy_context().run, func, *args
+            )
+
+        return await asyncio.wait_for(hedged(name, start), timeout=deadlines[name])
+
+    async def run_crawler(google_task):
+        try:
+            _, google_urls = await google_task
+        except Exception:
+            # Google failed or timed out, so there is nothing to crawl; None marks "never started".
+            return None
+        if not google_urls:
+            return []
+        crawled_data = await asyncio.wait_for(
+            crawl_with_async_webcrawler(google_urls[:3]),
+            timeout=deadlines["Crawler"],
+        )
+        logging.info(f"Crawled URLs: {google_urls[:3]}")
+        return crawled_data
+
+    # Providers whose circuit is open are not called at all.
+    skipped = [name for name in ["Google", *providers] if get_breaker(name).is_open()]
+    tasks = {}
+    if "Google" not in skipped:
+        tasks["Google"] = asyncio.ensure_future(run_provider("Google", google_search, query))
+        tasks["Crawler"] = asyncio.ensure_future(run_crawler(tasks["Google"]))
+    for name, func in SECONDARY_PROVIDERS.items():
+        if name in providers and name not in skipped:
+            tasks[name] = asyncio.ensure_future(run_provider(name, func, query))
+
+    _, pending = await asyncio.wait(tasks.values(), timeout=step_budget) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+
+    results = {}
+    timed_out = []
+    not_started = []
+    for name, task in tasks.items():
+        if task in pending or (not task.cancelled() and isinstance(task.exception(), asyncio.TimeoutError)):
+            timed_out.append(name)
+            continue
+        if task.cancelled():
+            continue
+        error = task.exception()
+        if name == "Crawler" and error is None and task.result() is None:
+            not_started.append(name)
+        elif error is not None:
+            logging.error(f"{name} Error: {error}")
+            results[name] = [f"{name} Error: {str(error)}"]
+        else:
+            results[name] = task.result()
+            if name in providers and calls is not None:
+                calls.append((name, providers[name], results[name]))
+            elif name in providers:
+                record_provider_results(name, providers[name], results[name])
+    if timed_out:
+        logging.warning(f"Providers timed out for '{query}': {', '.join(timed_out)}")
+
+    google_results = results.get("Google")
+    formatted_results = google_results[0] if google_results else []
+    for name in SECONDARY_PROVIDERS:
+        formatted_results += results.get(name, [])
+    crawled_data = results.get("Crawler", [])
+    if timed_out:
+        crawled_data = crawled_data + [f"[Search Status] Timed out: {', '.join(timed_out)}"]
+    if not_started:
+        crawled_data = crawled_data + [f"[Search Status] Not started (no Google results): {', '.join(not_started)}"]
+    if skipped:
+        logging.warning(f"Providers skipped for '{query}' (circuit open): {', '.join(skipped)}")
+        crawled_data = crawled_data + [f"[Search Status] Skipped (provider unavailable): {', '.join(skipped)}"]
+    return formatted_results, crawled_data
+
+# --- Main Search Function ---
+
+# Token budget for the text returned by one search_google call.
+SEARCH_RESULT_TOKENS = int(os.getenv("SEARCH_RESULT_TOKENS", "3000"))
+# What search_google returns instead of raising when the whole search fails.
+SEARCH_ERROR_MESSAGE = "An unexpected error occurred. Please try again later."
+
+
+def pack_search_results(query, results, token_budget=SEARCH_RESULT_TOKENS):
+    """Keep the passages of ``results`` most relevant to ``query`` within ``token_budget``.
+
+    The first line of each result is its source tag. The rest is chunked into
+    passages, ranked with BM25 and packed; kept passages are regrouped under
+    their tags in the original result order. Status lines are always kept.
+    """
+    full = "\n\n".join(results)
+    full_tokens = estimate_tokens(full)
+    if full_tokens <= token_budget:
+        return full
+
+    pinned = [r for r in results if r.startswith("[Search Status]")]
+    tags, chunks, texts, owners = [], [], [], []
+    for result in results:
+        if result.startswith("[Search Status]"):
+            continue
+        tag, _, body = result.partition("\n")
+        tags.append(tag)
+        for chunk in chunk_text(body) or [""]:
+            chunks.append(chunk)
+            # The tag is ranked and paid for with every passage; it usually names the source.
+            texts.append(f"{tag}\n{chunk}")
+            owners.append(len(tags) - 1)
+
+    remaining = max(token_budget - sum(estimate_tokens(r) for r in pinned), 0)
+    chosen = sorted(pack_passages(texts, BM25Index(texts).top(query), remaining))
+    groups = {}
+    for idx in chosen:
+        groups.setdefault(owners[idx], []).append(chunks[idx])
+    packed = "\n\n".join(
+        ["\n".join([tags[owner]] + [c for c in groups[owner] if c]) for owner in sorted(groups)] + pinned
+    )
+    sent_tokens = estimate_tokens(packed)
+    add_counts(search_tokens_full=full_tokens, search_tokens_sent=sent_tokens)
+    logging.info(f"Packed search results for '{query}': {sent_tokens} of {full_tokens} tokens")
+    return packed
+
+
+def search_google(query, fanout=None, step=None):
+    """Search all providers and return their results packed for the LLM.
+
+    Passages are ranked against ``query`` together with ``step``, the research
+    step the search is for, when given.
+    """
+    try:
+        logging.info(f"Query: {query}")
+        fanout = SEARCH_FANOUT if fanout is None else fanout
+        # Secondary providers unlikely to yield citable results for this step are not called.
+        providers = select_providers(f"{step} {query}" if step else query, list(SECONDARY_PROVIDERS))
+        logging.info(f"Secondary providers for '{query}': {', '.join(providers) or 'none'}")
+
+        # Provider results are recorded once packing shows which of their URLs the LLM gets to see.
+        calls = []
+        if fanout:
+            formatted_results, crawled_data = asyncio.run(
+                search_google_async(query, providers=providers, calls=calls)
+            )
+        else:
+            formatted_results, google_urls = google_search(query)
+            crawled_data = crawl_search_results(google_urls)
+            for name, context in providers.items():
+                provider_results = SECONDARY_PROVIDERS[name](query)
+                calls.append((name, context, provider_results))
+                formatted_results += provider_results
 
         # --- Ensure crawled results are included in output ---
         all_results = formatted_results + crawled_data
-        all_results = [r for r in all_results if r and r.strip()]
-        return "\n\n".join(all_results)
+        all_results = [r.strip() for r in all_results if r and r.strip()]
+        logging.info(f"Search cache stats: {search_cache.stats()}")
+        logging.info(f"HTTP pool stats: {http_stats()}")
+        logging.info(f"Unhealthy providers: {resilience_stats(unhealthy_only=True)}")
+        logging.info(f"Rate limiter stats: {ratelimit_stats()}")
+        logging.info(f"Source selector stats: {get_source_selector().stats()}")
+        packed = pack_search_results(f"{step} {query}" if step else query, all_results)
+        for name, context, provider_results in calls:
+            record_provider_results(name, context, provider_results, sent=packed)
+        return packed
 
     except Exception as e:
         logging.critical(f"Unexpected error occurred in search_google: {e}")
-        return "An unexpected error occurred. Please try again later."
\ No newline at end of file
+        return SEARCH_ERROR_MESSAGE
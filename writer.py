@@ -1,4 +1,14 @@
 from config import client
+from concurrent.futures import ThreadPoolExecutor
+from context_store import REPORT_CONTEXT_TOKENS
+from ranking import estimate_tokens, tfidf_matrix
+import numpy as np
+import logging
+import os
+import queue
+import re
+import time
+from tracing import span, submit
 
 
 def report_writer(context):
@@ -23,4 +33,168 @@ def report_writer(context):
     )
     return report_response.choices[0].message.content
 
-# Feedback loop
\ No newline at end of file
+# Feedback loop
+
+
+# --- Sectioned Report Writing ---
+
+# REPORT_MODE is "sectioned" (cluster, draft sections in parallel, merge) or
+# "single" (one report_writer call over the whole context).
+REPORT_MODE = os.getenv("REPORT_MODE", "sectioned")
+REPORT_SECTIONS = int(os.getenv("REPORT_SECTIONS", "4"))
+REFERENCES_MARKER = "---REFERENCES---"
+# Minimum seconds between streamed UI updates.
+UPDATE_INTERVAL = 0.1
+SOURCE_PATTERN = re.compile(r"https?://[^\s)\]>\"']+")
+
+
+def cluster_steps(texts, n_clusters=REPORT_SECTIONS, iterations=10):
+    """Group texts into at most ``n_clusters`` topical clusters (spherical k-means on TF-IDF).
+
+    Returns lists of indices; clusters and their members keep the input order.
+    """
+    n_clusters = min(n_clusters, len(texts))
+    if n_clusters <= 1:
+        return [list(range(len(texts)))] if texts else []
+    vectors = tfidf_matrix(texts).toarray()
+    # Farthest-point initialization keeps the result deterministic.
+    centers = [vectors[0]]
+    for _ in range(n_clusters - 1):
+        similarity = np.max(vectors @ np.array(centers).T, axis=1)
+        centers.append(vectors[int(np.argmin(similarity))])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centers.T, axis=1)
+        for k in range(n_clusters):
+            members = vectors[labels == k]
+            if len(members):
+                center = members.sum(axis=0)
+                norm = np.linalg.norm(center)
+                centers[k] = center / norm if norm else center
+    clusters = [[idx for idx in range(len(texts)) if labels[idx] == k] for k in range(n_clusters)]
+    return sorted((c for c in clusters if c), key=lambda c: c[0])
+
+
+def stream_completion(messages, on_delta):
+    """Stream a gpt-4.1 completion, passing each text delta to ``on_delta``; returns the full text."""
+    parts = []
+    with span("gpt-4.1", "llm", model="gpt-4.1", stream=True) as llm_span:
+        stream = client.chat.completions.create(model="gpt-4.1", messages=messages, stream=True)
+        usage = None
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    llm_span.set(first_token_seconds=llm_span.seconds)
+                parts.append(chunk.choices[0].delta.content)
+                on_delta(chunk.choices[0].delta.content)
+        text = "".join(parts)
+        if usage is not None:
+            llm_span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        else:
+            llm_span.set(
+                prompt_tokens=sum(estimate_tokens(m["content"]) for m in messages),
+                completion_tokens=estimate_tokens(text),
+                estimated_tokens=True,
+            )
+    return text
+
+
+def draft_section(query, context, on_delta):
+    section_prompt = (
+        f"Original research query: {query}\n\n"
+        f"Research steps and results for one part of the report:\n{context}\n\n"
+        "Write this part of a detailed research report as a markdown section starting with a level-2 heading. "
+        "Include every relevant detail from these results, provide in-depth analysis, and cite all sources explicitly (with URLs where available). "
+        "Do not write an introduction, conclusion or references list for the whole report."
+    )
+    return stream_completion(
+        [
+            {"role": "system", "content": "You are a research report writing assistant."},
+            {"role": "user", "content": section_prompt},
+        ],
+        on_delta,
+    )
+
+
+def report_writer_sectioned(query, context_store, on_update=None, n_sections=REPORT_SECTIONS):
+    """Write the report as concurrently drafted sections plus a short merge pass.
+
+    Step results are clustered into sections, each drafted from its own
+    budgeted slice of the context. ``on_update(markdown)`` is called on the
+    calling thread with the report so far as tokens stream in.
+    """
+    records = context_store.steps
+    clusters = cluster_steps([f"{step}\n{result}" for _, step, result in records], n_sections)
+    section_budget = max(REPORT_CONTEXT_TOKENS // max(len(clusters), 1), 2000)
+    sections = [""] * len(clusters)
+    header = ""
+    references = ""
+    events = queue.Queue()
+    last_update = 0.0
+
+    def render():
+        return "\n\n".join(part for part in [header, *sections, references] if part)
+
+    def maybe_update():
+        nonlocal last_update
+        if on_update and time.perf_counter() - last_update >= UPDATE_INTERVAL:
+            last_update = time.perf_counter()
+            on_update(render())
+
+    def draft(idx, cluster):
+        try:
+            # Any failure, including context selection, must still end this section's stream.
+            step_ids = {records[i][0] for i in cluster}
+            section_query = " ".join(records[i][1] for i in cluster)
+            context = context_store.select(section_query, section_budget, step_ids=step_ids)
+            draft_section(query, context, lambda delta: events.put((idx, delta)))
+        finally:
+            events.put((idx, None))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(len(clusters), 1), thread_name_prefix="report-section") as pool:
+        futures = [submit(pool, draft, idx, cluster) for idx, cluster in enumerate(clusters)]
+        remaining = len(clusters)
+        while remaining:
+            idx, delta = events.get()
+            if delta is None:
+                remaining -= 1
+                continue
+            sections[idx] += delta
+            maybe_update()
+        for future in futures:
+            future.result()
+    logging.info(f"Drafted {len(clusters)} report sections in {time.perf_counter() - started:.1f}s")
+
+    # Merge pass: title, executive summary and a deduplicated bibliography.
+    sources = sorted(set(SOURCE_PATTERN.findall("\n".join(sections))))
+    headings = "\n".join(line for section in sections for line in section.splitlines() if line.startswith("#"))
+    merge_prompt = (
+        f"Original research query: {query}\n\n"
+        f"The report body has these sections:\n{headings}\n\n"
+        f"Opening of each section:\n" + "\n\n".join(section[:1500] for section in sections) + "\n\n"
+        f"Sources cited in the report:\n" + "\n".join(sources) + "\n\n"
+        "Write a level-1 title for the report and a short executive summary that answers the query. "
+        f"Then write a line containing only {REFERENCES_MARKER} followed by a '## References' section "
+        "listing every source cited in the report, deduplicated."
+    )
+    merged = ""
+
+    def on_merge_delta(delta):
+        nonlocal merged, header, references
+        merged += delta
+        header, _, references = merged.partition(REFERENCES_MARKER)
+        maybe_update()
+
+    stream_completion(
+        [
+            {"role": "system", "content": "You are a research report writing assistant."},
+            {"role": "user", "content": merge_prompt},
+        ],
+        on_merge_delta,
+    )
+    header, references = header.strip(), references.strip()
+    if on_update:
+        on_update(render())
+    return render()